@@ -1,13 +1,22 @@
-from fastapi import FastAPI, Depends, HTTPException, Query
+from fastapi import FastAPI, Depends, HTTPException, Query, Request
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from sqlalchemy import insert, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import Awaitable, Callable, List, Literal, Optional
+import asyncio
 import datetime
+import json
+import time
 
+import config
 import database
+import event_export
+import metrics
+import rollups
+from pubsub import EventBroker
 
-# Initialize the database and tables on startup
-database.create_db_and_tables()
 app = FastAPI(
     title="People Counting API",
     description="API for managing areas and retrieving people counting statistics."
@@ -36,7 +45,116 @@ class StatsResponse(BaseModel):
     exits: int
     query_filters: dict
 
-# --- Database Dependency ---
+class AreaSummary(BaseModel):
+    area_id: int
+    name: str
+    entries: int
+    exits: int
+
+class TimeseriesPoint(BaseModel):
+    bucket_start: datetime.datetime
+    entries: int
+    exits: int
+    occupancy: int  # Running entries minus exits, including everything before the range
+
+class TimeseriesResponse(BaseModel):
+    area_id: int
+    interval: str
+    start: datetime.datetime
+    end: datetime.datetime
+    points: List[TimeseriesPoint]
+
+class EventCreate(BaseModel):
+    area_id: int
+    event_type: Literal['entry', 'exit']
+    tracker_id: Optional[int] = None
+    timestamp: Optional[datetime.datetime] = None  # Defaults to the time of ingestion
+
+class EventBatch(BaseModel):
+    events: List[EventCreate]
+
+class EventBatchResponse(BaseModel):
+    inserted: int
+    rejected: int  # Events for areas that don't exist
+
+# --- Time Series Intervals ---
+TIMESERIES_INTERVALS = {"5m": 300, "1h": 3600, "1d": 86400}  # Bucket size in seconds
+TIMESERIES_DEFAULT_WINDOWS = {"5m": 1, "1h": 7, "1d": 90}  # Days shown when no start date is given
+TIMESERIES_MAX_POINTS = 10000
+
+# --- Stats Summary Cache ---
+class SummaryCache:
+    """
+    Caches the all-areas summary for a short TTL. Cleared whenever events or areas change.
+    Concurrent requests on a cold cache wait for a single computation instead of each querying the database.
+    """
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._value = None
+        self._expires_at = 0.0
+        self._generation = 0
+        self._lock = asyncio.Lock()
+
+    async def get(self, compute: Callable[[], Awaitable[list]]) -> list:
+        async with self._lock:
+            if self._value is None or time.monotonic() >= self._expires_at:
+                generation = self._generation
+                value = await compute()
+                # Only cache it if nothing changed while it was computed; it may predate the change
+                if generation == self._generation:
+                    self._value = value
+                    self._expires_at = time.monotonic() + self.ttl
+                return value
+            return self._value
+
+    def invalidate(self):
+        # Lock-free, so the sync endpoints can call it from their worker threads
+        self._generation += 1
+        self._value = None
+
+summary_cache = SummaryCache(config.STATS_SUMMARY_TTL)
+broker = EventBroker()
+
+@app.on_event("startup")
+async def attach_broker():
+    broker.attach_loop(asyncio.get_running_loop())
+
+@app.on_event("startup")
+async def init_database():
+    """One-time database setup, run before the first request rather than at import."""
+    metrics.instrument_engine(database.engine)
+    metrics.instrument_engine(database.get_async_engine().sync_engine)
+    if config.DB_CREATE_SCHEMA_ON_STARTUP:
+        await database.create_db_and_tables_async()
+    async with database.get_async_sessionmaker()() as db:
+        await db.run_sync(rollups.backfill_if_empty)
+
+@app.on_event("shutdown")
+async def close_database():
+    await database.get_async_engine().dispose()
+
+# --- Metrics ---
+REQUEST_SECONDS = metrics.histogram(
+    "people_counter_http_request_seconds", "API request latency, up to the response headers.", ["method", "route", "status"],
+)
+EVENTS_INGESTED = metrics.counter("people_counter_events_ingested_total", "Events stored by the batch endpoint.", ["event_type"])
+EVENTS_REJECTED = metrics.counter("people_counter_events_rejected_total", "Events skipped because their area doesn't exist.")
+metrics.gauge("people_counter_live_subscribers", "Open live event streams.").set_function(lambda: broker.subscriber_count)
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # The route template rather than the raw path keeps one series per endpoint
+        route = request.scope.get("route")
+        REQUEST_SECONDS.labels(request.method, route.path if route else "unmatched", status).observe(time.perf_counter() - started)
+
+# --- Database Dependencies ---
 def get_db():
     db = database.SessionLocal()
     try:
@@ -44,6 +162,11 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    """Session on the asyncio engine, for the read and ingest endpoints. rollups' queries run on it through `run_sync`."""
+    async with database.get_async_sessionmaker()() as db:
+        yield db
+
 # --- API Endpoints ---
 @app.post("/api/areas/", response_model=AreaResponse, tags=["Areas"])
 def create_area(area: AreaCreate, db: Session = Depends(get_db)):
@@ -57,12 +180,13 @@ def create_area(area: AreaCreate, db: Session = Depends(get_db)):
     db.add(new_area)
     db.commit()
     db.refresh(new_area)
+    summary_cache.invalidate()
     return new_area
 
 @app.get("/api/areas/", response_model=List[AreaResponse], tags=["Areas"])
-def get_areas(db: Session = Depends(get_db)):
+async def get_areas(db: AsyncSession = Depends(get_async_db)):
     """Retrieve a list of all configured areas."""
-    areas = db.query(database.Area).all()
+    areas = (await db.scalars(select(database.Area))).all()
     return areas
 
 @app.delete("/api/areas/{area_id}", status_code=204, tags=["Areas"])
@@ -73,40 +197,199 @@ def delete_area(area_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=404, detail="Area not found")
     db.delete(db_area)
     db.commit()
+    summary_cache.invalidate()
+    broker.forget_area(area_id)
     return
 
+@app.get("/api/stats/summary", response_model=List[AreaSummary], tags=["Statistics"])
+async def get_stats_summary(db: AsyncSession = Depends(get_async_db)):
+    """Get lifetime entry/exit counts for every area in one query. Cached for a few seconds."""
+    async def compute():
+        return [
+            {"area_id": area_id, "name": name, "entries": entries, "exits": exits}
+            for area_id, name, entries, exits in await db.run_sync(rollups.summarize_areas)
+        ]
+    return await summary_cache.get(compute)
+
 @app.get("/api/stats/{area_id}", response_model=StatsResponse, tags=["Statistics"])
-def get_stats(
+async def get_stats(
     area_id: int,
     start_date: Optional[datetime.datetime] = Query(None, description="ISO 8601 format: YYYY-MM-DDTHH:MM:SS"),
     end_date: Optional[datetime.datetime] = Query(None, description="ISO 8601 format: YYYY-MM-DDTHH:MM:SS"),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Get total entry/exit counts for an area, with optional date filtering."""
-    query = db.query(database.CountingEvent).filter(database.CountingEvent.area_id == area_id)
-    
-    if start_date:
-        query = query.filter(database.CountingEvent.timestamp >= start_date)
-    if end_date:
-        query = query.filter(database.CountingEvent.timestamp <= end_date)
-
-    entries = query.filter(database.CountingEvent.event_type == 'entry').count()
-    exits = query.filter(database.CountingEvent.event_type == 'exit').count()
+    counts = await db.run_sync(rollups.count_events, area_id, start_date, end_date)
     
     return {
         "area_id": area_id,
-        "entries": entries,
-        "exits": exits,
+        "entries": counts['entry'],
+        "exits": counts['exit'],
         "query_filters": {"start_date": str(start_date) if start_date else None, "end_date": str(end_date) if end_date else None}
     }
 
+@app.get("/api/stats/{area_id}/timeseries", response_model=TimeseriesResponse, tags=["Statistics"])
+async def get_stats_timeseries(
+    area_id: int,
+    interval: Literal["5m", "1h", "1d"] = Query("1h", description="Bucket size"),
+    start: Optional[datetime.datetime] = Query(None, description="ISO 8601, inclusive. Defaults to 1/7/90 days before end for 5m/1h/1d."),
+    end: Optional[datetime.datetime] = Query(None, description="ISO 8601, exclusive. Defaults to now."),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Get entry/exit counts per time bucket for an area, with the running occupancy (entries minus exits)."""
+    seconds = TIMESERIES_INTERVALS[interval]
+    end = rollups.as_utc(end) if end else datetime.datetime.now(datetime.timezone.utc)
+    start = rollups.as_utc(start) if start else end - datetime.timedelta(days=TIMESERIES_DEFAULT_WINDOWS[interval])
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end.")
+
+    first_bucket = rollups.bucket_start(start, seconds)
+    num_buckets = int((end - first_bucket).total_seconds() // seconds) + 1
+    if num_buckets > TIMESERIES_MAX_POINTS:
+        raise HTTPException(status_code=400, detail=f"Range too large: {num_buckets} buckets (max {TIMESERIES_MAX_POINTS}). Use a larger interval.")
+
+    counts = await db.run_sync(rollups.count_by_bucket, area_id, seconds, start, end)
+    before = await db.run_sync(rollups.count_events, area_id, end=start - datetime.timedelta(microseconds=1))
+    occupancy = before['entry'] - before['exit']
+
+    points = []
+    for i in range(num_buckets):
+        bucket = first_bucket + datetime.timedelta(seconds=i * seconds)
+        if bucket >= end:
+            break
+        entries, exits = counts.get(bucket, (0, 0))
+        occupancy += entries - exits
+        points.append({"bucket_start": bucket, "entries": entries, "exits": exits, "occupancy": occupancy})
+
+    return {"area_id": area_id, "interval": interval, "start": start, "end": end, "points": points}
+
 @app.get("/api/stats/live/{area_id}", response_model=Optional[LiveEventResponse], tags=["Statistics"])
-def get_live_stats(area_id: int, db: Session = Depends(get_db)):
+async def get_live_stats(area_id: int, db: AsyncSession = Depends(get_async_db)):
     """Returns the most recent entry/exit event for a specific area."""
-    latest_event = db.query(database.CountingEvent) \
-        .filter(database.CountingEvent.area_id == area_id) \
-        .order_by(database.CountingEvent.timestamp.desc()) \
-        .first()
+    latest_event = await db.scalar(
+        select(database.CountingEvent)
+        .where(database.CountingEvent.area_id == area_id)
+        .order_by(database.CountingEvent.timestamp.desc())
+        .limit(1)
+    )
     if not latest_event:
         return None
-    return latest_event
\ No newline at end of file
+    return latest_event
+
+@app.post("/api/events/batch", response_model=EventBatchResponse, tags=["Events"])
+async def ingest_events(batch: EventBatch, db: AsyncSession = Depends(get_async_db)):
+    """
+    Bulk-insert entry/exit events with a single set-based INSERT and add them to the stats rollups.
+    Events for unknown areas are skipped.
+    """
+    if not batch.events:
+        return {"inserted": 0, "rejected": 0}
+
+    area_ids = {event.area_id for event in batch.events}
+    known_ids = set(await db.scalars(select(database.Area.id).where(database.Area.id.in_(area_ids))))
+    now = datetime.datetime.now(datetime.timezone.utc)
+    rows = [
+        {"area_id": e.area_id, "event_type": e.event_type, "tracker_id": e.tracker_id, "timestamp": rollups.as_utc(e.timestamp or now)}
+        for e in batch.events if e.area_id in known_ids
+    ]
+    if rows:
+        # End the lookup's transaction: nothing may hold database locks while waiting for another batch
+        await db.commit()
+        async with broker.publishing(known_ids):
+            await db.execute(insert(database.CountingEvent), rows)
+            await db.run_sync(rollups.add_to_rollups, rows)
+            await db.commit()
+            summary_cache.invalidate()
+            # publish_events can't await, so load the counters it needs first. Subscribers may connect
+            # during the loads, so check again; the last check and the publish run without an await between them.
+            loaded = {}
+            while missing := broker.areas_to_load(known_ids) - loaded.keys():
+                for area_id in missing:
+                    loaded[area_id] = await db.run_sync(rollups.count_events, area_id)
+            broker.publish_events(rows, loaded.get)
+        for row in rows:
+            EVENTS_INGESTED.labels(row["event_type"]).inc()
+    if len(rows) < len(batch.events):
+        EVENTS_REJECTED.inc(len(batch.events) - len(rows))
+    return {"inserted": len(rows), "rejected": len(batch.events) - len(rows)}
+
+@app.get("/api/events/export", tags=["Events"])
+async def export_events(
+    area_id: Optional[int] = Query(None, description="Only export this area."),
+    start: Optional[datetime.datetime] = Query(None, description="ISO 8601, inclusive."),
+    end: Optional[datetime.datetime] = Query(None, description="ISO 8601, exclusive."),
+    format: Literal["csv", "ndjson", "parquet"] = Query("csv"),
+    limit: Optional[int] = Query(None, ge=1, le=config.EXPORT_MAX_PAGE_SIZE, description="Return one page of at most this many events. Without it, every matching event is streamed."),
+    after: Optional[str] = Query(None, description="Cursor from the X-Next-Cursor header of the previous page."),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Export raw entry/exit events in (timestamp, id) order as CSV, NDJSON or Parquet.
+    A full export is streamed from a server-side cursor. With `limit`, one page is returned and
+    the X-Next-Cursor header holds the cursor for the next page, absent on the last one.
+    """
+    try:
+        cursor = event_export.decode_cursor(after) if after else None
+        encoder = event_export.make_encoder(format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    stmt = event_export.events_query(area_id, start, end, cursor, limit)
+    headers = {"Content-Disposition": f'attachment; filename="events.{format}"'}
+    media_type = event_export.MEDIA_TYPES[format]
+
+    if limit is not None:
+        rows = (await db.execute(stmt)).all()
+        if len(rows) == limit:
+            headers["X-Next-Cursor"] = event_export.encode_cursor(rows[-1].timestamp, rows[-1].id)
+        body = encoder.begin() + encoder.encode(rows) + encoder.end()
+        return Response(body, media_type=media_type, headers=headers)
+
+    async def export_source():
+        # Opened here rather than through a dependency, so the connection lives as long as the stream
+        async with database.get_async_engine().connect() as conn:
+            if conn.dialect.name == "postgresql":
+                # A long export reads from one cursor; DB_STATEMENT_TIMEOUT_MS would cut it off
+                await conn.execute(text("SET LOCAL statement_timeout = 0"))
+            result = await conn.stream(stmt.execution_options(yield_per=config.EXPORT_CHUNK_SIZE))
+            yield encoder.begin()
+            async for rows in result.partitions():
+                yield encoder.encode(rows)
+            yield encoder.end()
+
+    return StreamingResponse(export_source(), media_type=media_type, headers=headers)
+
+@app.get("/api/events/stream", tags=["Events"])
+async def stream_events(request: Request, area_id: Optional[List[int]] = Query(None, description="Only stream these areas. Repeat for several.")):
+    """
+    Server-Sent Events stream of every entry/exit event as it is ingested, each followed by
+    the area's updated lifetime counters. Replaces polling /api/stats/live.
+    """
+    subscription = broker.subscribe(area_id)
+
+    async def event_source():
+        try:
+            yield ": connected\n\n"
+            while True:
+                try:
+                    message = await asyncio.wait_for(subscription.get(), timeout=config.LIVE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: {message['type']}\ndata: {json.dumps(message)}\n\n"
+        finally:
+            broker.unsubscribe(subscription)
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/metrics", response_class=PlainTextResponse, tags=["Monitoring"])
+def get_metrics():
+    """Prometheus metrics: request latency, database query timing and event ingestion."""
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
\ No newline at end of file
@@ -0,0 +1,212 @@
+"""
+Inference backends for the detector.
+
+INFERENCE_BACKEND picks how the YOLO weights are run:
+    torch        the PyTorch weights as they are
+    onnxruntime  an ONNX export, run with ONNX Runtime
+    openvino     an OpenVINO export, run with the OpenVINO runtime
+
+Exports are made once and cached next to the weights (yolo11n.onnx, yolo11n_openvino_model/),
+and redone when the weights are newer than the export. They use dynamic input shapes, so the
+batch size and the smaller input sizes used for ROI crops keep working.
+
+With INFERENCE_INT8, the export is also quantized to INT8 using frames sampled from
+INFERENCE_CALIBRATION_SOURCE (a video or a folder of images from the target cameras),
+cached as yolo11n_int8.onnx / yolo11n_int8_openvino_model/.
+
+The extra packages are only needed for the backend in use:
+    pip install onnx onnxruntime      # onnxruntime
+    pip install openvino nncf         # openvino (nncf only for INT8)
+
+Exports can be built ahead of time, e.g. in a Docker build step, with:
+    python backends.py export openvino --int8
+"""
+import argparse
+import contextlib
+import fcntl
+import glob
+import logging
+import os
+import shutil
+from typing import Iterator, List
+
+import cv2
+import numpy as np
+
+import config
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("torch", "onnxruntime", "openvino")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+def exported_path(weights: str, backend: str, int8: bool = False) -> str:
+    """Where the export of `weights` for `backend` is cached."""
+    stem, _ = os.path.splitext(weights)
+    suffix = "_int8" if int8 else ""
+    if backend == "onnxruntime":
+        return f"{stem}{suffix}.onnx"
+    if backend == "openvino":
+        return f"{stem}{suffix}_openvino_model"
+    raise ValueError(f"Unknown inference backend '{backend}'. Choose one of {', '.join(BACKENDS)}.")
+
+def _is_fresh(path: str, weights: str) -> bool:
+    return os.path.exists(path) and (not os.path.exists(weights) or os.path.getmtime(path) >= os.path.getmtime(weights))
+
+@contextlib.contextmanager
+def _export_lock(weights: str) -> Iterator[None]:
+    """Stops several worker processes from exporting the same weights at once."""
+    with open(f"{weights}.export.lock", "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def _require(module: str, packages: str):
+    try:
+        __import__(module)
+    except ImportError as e:
+        raise RuntimeError(f"This inference backend needs extra packages: pip install {packages}") from e
+
+def prepare_model(
+    weights: str = config.MODEL_PATH,
+    backend: str = config.INFERENCE_BACKEND,
+    int8: bool = config.INFERENCE_INT8,
+    calibration_source: str = config.INFERENCE_CALIBRATION_SOURCE,
+    imgsz: int = config.MODEL_IMGSZ,
+) -> str:
+    """Returns the model file to load for `backend`, exporting (and quantizing) the weights first if needed."""
+    if backend == "torch":
+        if int8:
+            logger.warning("INT8 is only supported by the onnxruntime and openvino backends; using the FP32 weights.")
+        return weights
+    path = exported_path(weights, backend, int8)
+    if _is_fresh(path, weights):
+        return path
+
+    with _export_lock(weights):
+        if _is_fresh(path, weights):
+            return path  # Another process exported it while we waited
+        fp_path = exported_path(weights, backend)
+        if not _is_fresh(fp_path, weights):
+            _export(weights, backend, imgsz)
+        if int8:
+            if not calibration_source:
+                raise ValueError("INT8 quantization needs INFERENCE_CALIBRATION_SOURCE (a video or a folder of images).")
+            frames = calibration_frames(calibration_source, config.INFERENCE_CALIBRATION_FRAMES, imgsz)
+            logger.info("Quantizing %s to INT8 with %d calibration frames...", fp_path, len(frames))
+            if backend == "onnxruntime":
+                _quantize_onnx(fp_path, path, frames)
+            else:
+                _quantize_openvino(fp_path, path, frames)
+    return path
+
+def _export(weights: str, backend: str, imgsz: int):
+    from pipeline import load_model
+
+    if backend == "onnxruntime":
+        _require("onnx", "onnx onnxruntime")
+        fmt = "onnx"
+    else:
+        _require("openvino", "openvino")
+        fmt = "openvino"
+    logger.info("Exporting %s to %s (cached next to the weights)...", weights, fmt)
+    exported = load_model(weights).export(format=fmt, imgsz=imgsz, dynamic=True)
+    expected = exported_path(weights, backend)
+    if os.path.abspath(exported) != os.path.abspath(expected):
+        # Weights that were downloaded by name end up in the working directory
+        shutil.move(exported, expected)
+
+def letterbox(frame: np.ndarray, imgsz: int) -> np.ndarray:
+    """Resizes and pads a BGR frame the way the model's preprocessing does, returning a (1, 3, imgsz, imgsz) float32 input."""
+    height, width = frame.shape[:2]
+    scale = min(imgsz / height, imgsz / width)
+    resized = cv2.resize(frame, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_LINEAR)
+    top = (imgsz - resized.shape[0]) // 2
+    left = (imgsz - resized.shape[1]) // 2
+    padded = cv2.copyMakeBorder(
+        resized, top, imgsz - resized.shape[0] - top, left, imgsz - resized.shape[1] - left,
+        cv2.BORDER_CONSTANT, value=(114, 114, 114),
+    )
+    rgb = cv2.cvtColor(padded, cv2.COLOR_BGR2RGB)
+    return np.ascontiguousarray(rgb.transpose(2, 0, 1)[None], dtype=np.float32) / 255.0
+
+def calibration_frames(source: str, count: int, imgsz: int) -> List[np.ndarray]:
+    """Samples up to `count` frames evenly from a video or a folder of images, preprocessed for the model."""
+    if os.path.isdir(source):
+        paths = sorted(p for p in glob.glob(os.path.join(source, "*")) if p.lower().endswith(IMAGE_EXTENSIONS))
+        step = max(1, len(paths) // max(count, 1))
+        frames = [cv2.imread(p) for p in paths[::step][:count]]
+    else:
+        cap = cv2.VideoCapture(source)
+        total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) or count
+        step = max(1, total // max(count, 1))
+        frames = []
+        index = 0
+        while len(frames) < count:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            if index % step == 0:
+                frames.append(frame)
+            index += 1
+        cap.release()
+    frames = [letterbox(frame, imgsz) for frame in frames if frame is not None]
+    if not frames:
+        raise ValueError(f"No calibration frames could be read from '{source}'.")
+    return frames
+
+def _quantize_onnx(fp_path: str, int8_path: str, frames: List[np.ndarray]):
+    _require("onnxruntime.quantization", "onnx onnxruntime")
+    import onnxruntime
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+    input_name = onnxruntime.InferenceSession(fp_path, providers=["CPUExecutionProvider"]).get_inputs()[0].name
+
+    class FrameReader(CalibrationDataReader):
+        def __init__(self):
+            self._frames = iter(frames)
+
+        def get_next(self):
+            frame = next(self._frames, None)
+            return None if frame is None else {input_name: frame}
+
+    quantize_static(
+        fp_path, int8_path, FrameReader(),
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=True,
+        # Only the convolutions; the box decoding at the end of the graph stays in float
+        op_types_to_quantize=["Conv", "MatMul"],
+    )
+
+def _quantize_openvino(fp_dir: str, int8_dir: str, frames: List[np.ndarray]):
+    _require("nncf", "openvino nncf")
+    import nncf
+    import openvino as ov
+
+    xml = glob.glob(os.path.join(fp_dir, "*.xml"))[0]
+    model = ov.Core().read_model(xml)
+    quantized = nncf.quantize(
+        model, nncf.Dataset(frames),
+        preset=nncf.QuantizationPreset.MIXED,
+        # Keep the box decoding of the detection head in float, as ultralytics does for its own INT8 exports
+        ignored_scope=nncf.IgnoredScope(types=["Multiply", "Subtract", "Sigmoid"]),
+    )
+    os.makedirs(int8_dir, exist_ok=True)
+    ov.save_model(quantized, os.path.join(int8_dir, os.path.basename(xml)))
+    # ultralytics reads the class names and input size from here
+    shutil.copy(os.path.join(fp_dir, "metadata.yaml"), int8_dir)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(message)s")
+    parser = argparse.ArgumentParser(description="Build the cached model export for an inference backend.")
+    parser.add_argument("command", choices=["export"])
+    parser.add_argument("backend", choices=BACKENDS[1:])
+    parser.add_argument("--weights", default=config.MODEL_PATH)
+    parser.add_argument("--int8", action="store_true", help="Also quantize to INT8.")
+    parser.add_argument("--calibration-source", default=config.INFERENCE_CALIBRATION_SOURCE, help="Video or image folder for INT8 calibration.")
+    args = parser.parse_args()
+    print(prepare_model(args.weights, args.backend, args.int8, args.calibration_source))
@@ -0,0 +1,489 @@
+"""
+Offline benchmark of the counting pipeline.
+
+Renders a synthetic video of scripted people walking through (and past) a polygon, runs the
+counting loop on it frame by frame and reports the time spent per stage (decode, inference,
+tracking, zone test, annotate, DB write), frames per second, peak RSS and the counts against
+the scripted ground truth. Results are written as JSON; pass a previous result as --baseline
+to fail (exit status 1) when throughput, memory or accuracy regressed.
+
+Give --backend several times to compare inference backends on the same video: each one
+is run in turn, and its latency, counts and per-frame detection agreement with the first
+backend (precision/recall/F1 at IoU 0.5) are reported side by side. Append ":int8" to a
+backend for its INT8 export.
+
+The stub detector finds the synthetic people by thresholding, so it is deterministic and
+measures everything except the model. With --detector yolo the real model runs instead;
+it won't recognise the synthetic figures as people, so use it with --video, --polygon and
+--truth on a real recording for meaningful accuracy.
+
+Usage:
+    python benchmark.py --detector stub --output results.json
+    python benchmark.py --detector yolo --device cpu --baseline results.json
+    python benchmark.py --detector yolo --backend torch --backend onnxruntime --backend openvino:int8
+    python benchmark.py --video door.mp4 --polygon "100,400 600,400 600,700 100,700" --truth 12,9 --detector yolo
+"""
+import argparse
+import collections
+import contextlib
+import datetime
+import json
+import math
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+# The benchmark writes to its own database (--db-url), so it doesn't need a configured one
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import cv2
+import numpy as np
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import Session
+
+import config
+import database
+import rollups
+from pipeline import StreamCounter, box_iou, clean_polygon
+from preview import render_preview
+from roi import RegionOfInterest
+
+STAGES = ("decode", "inference", "tracking", "zone_test", "annotate", "db_write")
+
+class ScriptedPerson(NamedTuple):
+    """A synthetic person: a box of `size` whose bottom-center walks from `start` to `end` over frames [first, last]."""
+    first: int
+    last: int
+    start: Tuple[float, float]
+    end: Tuple[float, float]
+    size: Tuple[int, int]
+    color: Tuple[int, int, int]
+
+    def box(self, frame_index: int) -> Optional[Tuple[int, int, int, int]]:
+        if not self.first <= frame_index <= self.last:
+            return None
+        t = (frame_index - self.first) / max(self.last - self.first, 1)
+        x = self.start[0] + t * (self.end[0] - self.start[0])
+        y = self.start[1] + t * (self.end[1] - self.start[1])
+        w, h = self.size
+        return int(x - w / 2), int(y - h), int(x + w / 2), int(y)
+
+class Scenario(NamedTuple):
+    width: int
+    height: int
+    fps: float
+    frames: int
+    polygon: np.ndarray
+    people: List[ScriptedPerson]
+
+def make_scenario(people: int, frames: int, width: int, height: int, fps: float, seed: int) -> Scenario:
+    """
+    Scripts `people` walkers in three lanes: one crossing the polygon left to right, one crossing it
+    right to left, and one passing above it. Walkers in a lane are spaced so they never overlap.
+    """
+    rng = np.random.default_rng(seed)
+    polygon = np.array([
+        [0.35 * width, 0.35 * height], [0.65 * width, 0.35 * height],
+        [0.65 * width, 0.85 * height], [0.35 * width, 0.85 * height],
+    ], dtype=np.int32)
+    box_w, box_h = int(0.04 * width), int(0.17 * height)
+    lanes = [
+        ((-box_w, 0.60 * height), (width + box_w, 0.60 * height)),  # crosses, left to right
+        ((width + box_w, 0.80 * height), (-box_w, 0.80 * height)),  # crosses, right to left
+        ((-box_w, 0.25 * height), (width + box_w, 0.25 * height)),  # passes above the polygon
+    ]
+    walk = int(6 * fps)
+    per_lane = math.ceil(people / len(lanes))
+    gap = max(int(1.5 * fps), (frames - walk) // max(per_lane, 1))
+
+    scripted = []
+    for i in range(people):
+        lane, slot = i % len(lanes), i // len(lanes)
+        first = slot * gap + int(rng.integers(0, max(gap // 4, 1)))
+        duration = int(walk * rng.uniform(0.8, 1.2))
+        if first + duration >= frames:
+            break
+        start, end = lanes[lane]
+        color = tuple(int(c) for c in rng.integers(160, 256, size=3))
+        scripted.append(ScriptedPerson(first, first + duration, start, end, (box_w, box_h), color))
+    return Scenario(width, height, fps, frames, polygon, scripted)
+
+def render_video(scenario: Scenario, path: str, seed: int):
+    """Writes the scenario as an mp4 with a textured background and a little sensor noise."""
+    rng = np.random.default_rng(seed)
+    gradient = np.linspace(30, 70, scenario.width, dtype=np.float32)
+    background = np.repeat(np.tile(gradient, (scenario.height, 1))[:, :, None], 3, axis=2).astype(np.uint8)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), scenario.fps, (scenario.width, scenario.height))
+    if not writer.isOpened():
+        raise RuntimeError(f"Could not write the synthetic video to '{path}'.")
+    try:
+        for frame_index in range(scenario.frames):
+            frame = cv2.add(background, rng.integers(0, 12, background.shape, dtype=np.uint8))
+            for person in scenario.people:
+                box = person.box(frame_index)
+                if box is not None:
+                    cv2.rectangle(frame, box[:2], box[2:], person.color, thickness=-1)
+            writer.write(frame)
+    finally:
+        writer.release()
+
+def ground_truth(scenario: Scenario) -> Dict[str, int]:
+    """Counts every scripted crossing of the polygon edge. Like in the ZoneEngine, a track starts outside."""
+    polygon = scenario.polygon.reshape(-1, 1, 2).astype(np.float32)
+    totals = {"entry": 0, "exit": 0}
+    for person in scenario.people:
+        was_inside = False
+        for frame_index in range(person.first, person.last + 1):
+            x1, _, x2, y2 = person.box(frame_index)
+            if x2 < 0 or x1 >= scenario.width:
+                continue  # Off screen, so nothing to detect
+            is_inside = cv2.pointPolygonTest(polygon, ((x1 + x2) // 2, y2), False) >= 0
+            if is_inside != was_inside:
+                totals["entry" if is_inside else "exit"] += 1
+            was_inside = is_inside
+    return totals
+
+class StubDetector:
+    """Deterministic stand-in for the model: every bright blob of at least `min_area` pixels is a person."""
+    def __init__(self, threshold: int = 110, min_area: int = 400):
+        self.threshold = threshold
+        self.min_area = min_area
+
+    def detect(self, frames: List[np.ndarray], rois: Optional[List[Optional[RegionOfInterest]]] = None) -> List[np.ndarray]:
+        detections = []
+        for frame, roi in zip(frames, rois or [None] * len(frames)):
+            box = roi.crop_box(frame.shape) if roi else None
+            x0, y0 = (box[0], box[1]) if box else (0, 0)
+            crop = frame[box[1]:box[3], box[0]:box[2]] if box else frame
+            mask = (cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY) > self.threshold).astype(np.uint8)
+            _, _, stats, _ = cv2.connectedComponentsWithStats(mask)
+            rows = [
+                [x0 + x, y0 + y, x0 + x + w, y0 + y + h, 0.9, 0]
+                for x, y, w, h, area in stats[1:] if area >= self.min_area
+            ]
+            detections.append(np.array(rows, dtype=np.float32).reshape(-1, 6))
+        return detections
+
+class StageTimer:
+    """Collects the wall time of every call of each pipeline stage."""
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = collections.defaultdict(list)
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.samples[name].append(time.perf_counter() - started)
+
+    def report(self, wall_seconds: float) -> Dict[str, dict]:
+        report = {}
+        for name in STAGES:
+            samples = np.array(self.samples.get(name, []))
+            if not len(samples):
+                continue
+            report[name] = {
+                "calls": int(len(samples)),
+                "total_seconds": round(float(samples.sum()), 4),
+                "share": round(float(samples.sum()) / max(wall_seconds, 1e-9), 4),
+                "mean_ms": round(float(samples.mean()) * 1000, 3),
+                "p50_ms": round(float(np.percentile(samples, 50)) * 1000, 3),
+                "p95_ms": round(float(np.percentile(samples, 95)) * 1000, 3),
+                "max_ms": round(float(samples.max()) * 1000, 3),
+            }
+        return report
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def open_database(db_url: str) -> Tuple[Session, int]:
+    """Creates the schema in the benchmark database and returns a session and the id of a fresh area."""
+    engine = create_engine(db_url)
+    database.Base.metadata.create_all(engine)
+    db = Session(engine)
+    area = database.Area(name=f"benchmark-{datetime.datetime.now():%Y%m%d-%H%M%S}", coordinates=[])
+    db.add(area)
+    db.commit()
+    return db, area.id
+
+def write_events(db: Session, rows: List[dict]):
+    """Writes events the way the API's batch ingest does: one INSERT plus the rollup upsert, in one transaction."""
+    db.execute(insert(database.CountingEvent), rows)
+    rollups.add_to_rollups(db, rows)
+    db.commit()
+
+def run_pipeline(
+    video: str,
+    polygon: np.ndarray,
+    detector,
+    db: Session,
+    area_id: int,
+    annotate: bool = True,
+    use_roi: bool = False,
+    db_batch: int = config.EVENT_BUFFER_SIZE,
+    max_frames: Optional[int] = None,
+    detections_log: Optional[List[np.ndarray]] = None,
+) -> dict:
+    """
+    Runs the counting loop over `video` one stage at a time and returns the timings and counts.
+    The raw detections of every frame are appended to `detections_log` if one is given.
+    """
+    from inference import StreamTracker
+
+    cap = cv2.VideoCapture(video)
+    if not cap.isOpened():
+        raise RuntimeError(f"Could not open '{video}'.")
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30
+    polygons = {area_id: polygon}
+    tracker = StreamTracker(frame_rate=fps)
+    counter = StreamCounter(polygons)
+    roi = RegionOfInterest(polygons) if use_roi else None
+    timer = StageTimer()
+    started_at = datetime.datetime.now(datetime.timezone.utc)
+    pending: List[dict] = []
+    frames = events_written = 0
+
+    started = time.perf_counter()
+    try:
+        while max_frames is None or frames < max_frames:
+            with timer.stage("decode"):
+                ok, frame = cap.read()
+            if not ok:
+                break
+            with timer.stage("inference"):
+                detections = detector.detect([frame], [roi])[0]
+            if detections_log is not None:
+                detections_log.append(detections)
+            with timer.stage("tracking"):
+                boxes, track_ids = tracker.update(detections, frame)
+            with timer.stage("zone_test"):
+                events = counter.update(boxes, track_ids)
+            if annotate:
+                with timer.stage("annotate"):
+                    render_preview(frame, polygons, boxes, track_ids, counter.entry_counts, counter.exit_counts)
+
+            timestamp = started_at + datetime.timedelta(seconds=frames / fps)
+            pending.extend(
+                {"area_id": e.area_id, "event_type": e.event_type, "tracker_id": e.tracker_id, "timestamp": timestamp}
+                for e in events
+            )
+            if len(pending) >= db_batch:
+                with timer.stage("db_write"):
+                    write_events(db, pending)
+                events_written += len(pending)
+                pending = []
+            frames += 1
+        if pending:
+            with timer.stage("db_write"):
+                write_events(db, pending)
+            events_written += len(pending)
+    finally:
+        cap.release()
+    wall_seconds = time.perf_counter() - started
+
+    return {
+        "frames": frames,
+        "wall_seconds": round(wall_seconds, 3),
+        "fps": round(frames / max(wall_seconds, 1e-9), 2),
+        "realtime_factor": round(frames / fps / max(wall_seconds, 1e-9), 2),
+        "stages": timer.report(wall_seconds),
+        "events_written": events_written,
+        "counts": {"entry": counter.entry_counts[area_id], "exit": counter.exit_counts[area_id]},
+    }
+
+def accuracy(counts: Dict[str, int], truth: Dict[str, int]) -> dict:
+    """Per event type counted vs expected, and the total relative count error."""
+    report = {event_type: {"expected": truth[event_type], "counted": counts[event_type]} for event_type in ("entry", "exit")}
+    report["count_error"] = round(
+        sum(abs(counts[t] - truth[t]) for t in ("entry", "exit")) / max(truth["entry"] + truth["exit"], 1), 4
+    )
+    return report
+
+def detection_agreement(reference: List[np.ndarray], other: List[np.ndarray], iou_threshold: float = 0.5) -> dict:
+    """
+    Precision, recall and F1 of `other`'s detections against `reference`, frame by frame,
+    matching boxes greedily by IoU.
+    """
+    matched = total_reference = total_other = 0
+    for ref, det in zip(reference, other):
+        total_reference += len(ref)
+        total_other += len(det)
+        if not len(ref) or not len(det):
+            continue
+        iou = box_iou(ref[:, :4], det[:, :4])
+        while iou.size and iou.max() >= iou_threshold:
+            i, j = np.unravel_index(iou.argmax(), iou.shape)
+            matched += 1
+            iou[i, :] = 0
+            iou[:, j] = 0
+    precision = matched / max(total_other, 1)
+    recall = matched / max(total_reference, 1)
+    return {
+        "precision": round(precision, 4),
+        "recall": round(recall, 4),
+        "f1": round(2 * precision * recall / max(precision + recall, 1e-9), 4),
+    }
+
+def compare(result: dict, baseline: dict, max_regression: float) -> List[str]:
+    """Returns a description of every metric that regressed against `baseline` by more than `max_regression`."""
+    failures = []
+    if result["fps"] < baseline["fps"] * (1 - max_regression):
+        failures.append(f"fps dropped from {baseline['fps']} to {result['fps']}")
+    if result["peak_rss_mb"] > baseline["peak_rss_mb"] * (1 + max_regression):
+        failures.append(f"peak RSS grew from {baseline['peak_rss_mb']} MB to {result['peak_rss_mb']} MB")
+    old_error = (baseline.get("accuracy") or {}).get("count_error")
+    new_error = (result.get("accuracy") or {}).get("count_error")
+    if old_error is not None and new_error is not None and new_error > old_error + 1e-9:
+        failures.append(f"count error grew from {old_error:.1%} to {new_error:.1%}")
+    return failures
+
+def parse_counts(value: str) -> Dict[str, int]:
+    entries, exits = (int(n) for n in value.split(","))
+    return {"entry": entries, "exit": exits}
+
+def parse_polygon(value: str) -> np.ndarray:
+    polygon = clean_polygon([[int(n) for n in point.split(",")] for point in value.split()])
+    if polygon is None:
+        raise argparse.ArgumentTypeError("A polygon needs at least 3 'x,y' points.")
+    return polygon
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the counting pipeline on a synthetic or recorded video.")
+    parser.add_argument("--detector", choices=("stub", "yolo"), default="stub")
+    parser.add_argument("--model", default=config.MODEL_PATH, help="Weights for --detector yolo.")
+    parser.add_argument("--device", default="cpu", help="Device for --detector yolo (default: cpu).")
+    parser.add_argument(
+        "--backend", action="append",
+        help="Inference backend for --detector yolo: torch, onnxruntime or openvino, with ':int8' for the INT8 export. "
+             f"Repeat to compare backends (default: {config.INFERENCE_BACKEND}).",
+    )
+    parser.add_argument("--video", help="Benchmark this recording instead of a synthetic video. Needs --polygon.")
+    parser.add_argument("--polygon", type=parse_polygon, help="Polygon of --video as 'x,y x,y x,y ...'.")
+    parser.add_argument("--truth", type=parse_counts, help="Expected 'entries,exits' of --video, for the accuracy report.")
+    parser.add_argument("--people", type=int, default=24, help="Scripted people in the synthetic video.")
+    parser.add_argument("--frames", type=int, default=1500, help="Length of the synthetic video in frames.")
+    parser.add_argument("--size", default="1280x720", help="Synthetic video size as WIDTHxHEIGHT.")
+    parser.add_argument("--fps", type=float, default=25.0, help="Synthetic video frame rate.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-annotate", action="store_true", help="Skip the annotate stage, like a headless worker nobody watches.")
+    parser.add_argument("--roi", action="store_true", help="Detect on a crop around the polygon (ROI_CROP).")
+    parser.add_argument("--db-url", help="Database for the DB write stage (default: a temporary SQLite file).")
+    parser.add_argument("--db-batch", type=int, default=config.EVENT_BUFFER_SIZE, help="Events per DB write.")
+    parser.add_argument("--output", default="benchmark_results.json", help="Where to write the JSON results.")
+    parser.add_argument("--baseline", help="Previous JSON results to compare against.")
+    parser.add_argument("--max-regression", type=float, default=0.10, help="Allowed relative fps/RSS regression (default: 0.10).")
+    args = parser.parse_args()
+    if args.video and args.polygon is None:
+        parser.error("--video needs --polygon.")
+    if args.backend and args.detector != "yolo":
+        parser.error("--backend needs --detector yolo.")
+    backends = args.backend or [config.INFERENCE_BACKEND + (":int8" if config.INFERENCE_INT8 else "")]
+
+    with tempfile.TemporaryDirectory(prefix="people-counter-bench-") as workdir:
+        truth = args.truth
+        if args.video:
+            video, polygon = args.video, args.polygon
+        else:
+            width, height = (int(n) for n in args.size.lower().split("x"))
+            scenario = make_scenario(args.people, args.frames, width, height, args.fps, args.seed)
+            video, polygon = os.path.join(workdir, "synthetic.mp4"), scenario.polygon
+            print(f"Rendering {args.frames} frames at {width}x{height} with {len(scenario.people)} people...")
+            render_video(scenario, video, args.seed)
+            truth = ground_truth(scenario)
+
+        runs: Dict[str, dict] = {}
+        detections: Dict[str, List[np.ndarray]] = {}
+        for backend in backends if args.detector == "yolo" else ["stub"]:
+            if args.detector == "stub":
+                detector = StubDetector()
+            else:
+                from inference import Detector
+                name, _, variant = backend.partition(":")
+                detector = Detector(args.model, device=args.device, backend=name, int8=variant == "int8")
+            db, area_id = open_database(args.db_url or f"sqlite:///{os.path.join(workdir, 'benchmark.db')}")
+            try:
+                print(f"Running the pipeline with the {backend} detector...")
+                detections[backend] = []
+                runs[backend] = run_pipeline(
+                    video, polygon, detector, db, area_id, annotate=not args.no_annotate, use_roi=args.roi,
+                    db_batch=args.db_batch, detections_log=detections[backend] if len(backends) > 1 else None,
+                )
+            finally:
+                db.close()
+
+    reference = next(iter(runs))
+    result = {
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "settings": {
+            "detector": args.detector,
+            "model": args.model if args.detector == "yolo" else None,
+            "device": args.device if args.detector == "yolo" else None,
+            "backend": backends[0] if args.detector == "yolo" else None,
+            "video": args.video or f"synthetic {args.size} @ {args.fps:g} fps, {args.people} people, seed {args.seed}",
+            "annotate": not args.no_annotate,
+            "roi": args.roi,
+            "db": "postgresql" if (args.db_url or "").startswith("postgres") else "sqlite",
+            "db_batch": args.db_batch,
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+            "opencv": cv2.__version__,
+            "numpy": np.__version__,
+        },
+        **runs[reference],
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "accuracy": accuracy(runs[reference]["counts"], truth) if truth else None,
+    }
+    if len(runs) > 1:
+        result["backends"] = {
+            backend: {
+                "fps": run["fps"],
+                "inference": run["stages"]["inference"],
+                "counts": run["counts"],
+                "accuracy": accuracy(run["counts"], truth) if truth else None,
+                "agreement_with_" + reference.replace(":", "_"): detection_agreement(detections[reference], detections[backend]),
+            }
+            for backend, run in runs.items()
+        }
+    with open(args.output, "w") as f:
+        json.dump(result, f, indent=2)
+
+    print(f"Frames: {result['frames']} in {result['wall_seconds']:.1f}s = {result['fps']:.1f} fps "
+          f"({result['realtime_factor']:.1f}x real time), peak RSS {result['peak_rss_mb']:.0f} MB")
+    print(f"{'stage':>10} {'share':>7} {'mean ms':>9} {'p95 ms':>9}")
+    for name, stage in result["stages"].items():
+        print(f"{name:>10} {stage['share']:>7.1%} {stage['mean_ms']:>9.2f} {stage['p95_ms']:>9.2f}")
+    if result["accuracy"]:
+        acc = result["accuracy"]
+        print(f"Entries {acc['entry']['counted']}/{acc['entry']['expected']}, exits {acc['exit']['counted']}/{acc['exit']['expected']}, "
+              f"count error {acc['count_error']:.1%}")
+    if "backends" in result:
+        print(f"\n{'backend':>18} {'fps':>8} {'infer ms':>9} {'entries':>8} {'exits':>6} {'F1 vs ' + reference:>20}")
+        for backend, run in result["backends"].items():
+            agreement = run["agreement_with_" + reference.replace(":", "_")]
+            print(f"{backend:>18} {run['fps']:>8.1f} {run['inference']['mean_ms']:>9.2f} "
+                  f"{run['counts']['entry']:>8} {run['counts']['exit']:>6} {agreement['f1']:>20.3f}")
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures = compare(result, json.load(f), args.max_regression)
+        if failures:
+            for failure in failures:
+                print(f"REGRESSION: {failure}")
+            sys.exit(1)
+        print("No regressions against the baseline.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+import collections
+import os
+import threading
+import time
+from typing import Callable, NamedTuple, Optional
+
+import cv2
+import numpy as np
+
+import config
+
+class CapturedFrame(NamedTuple):
+    """A decoded frame together with the time it entered the capture queue."""
+    frame: np.ndarray
+    index: int  # Position of the frame in the source, counting from 0
+    captured_at: float  # time.monotonic() when the frame was decoded
+
+class CaptureStats(NamedTuple):
+    frames_read: int
+    frames_dropped: int
+    avg_queue_wait: float  # Seconds
+    max_queue_wait: float  # Seconds
+
+def is_live_source(source: str) -> bool:
+    """Anything that is not a local file (RTSP/HTTP URLs, device indices) is treated as a live feed."""
+    return not os.path.isfile(source)
+
+class FrameGrabber:
+    """
+    Reads and decodes frames on a background thread into a bounded queue, so decoding
+    keeps up with the source while the consumer runs inference.
+
+    Live sources drop the oldest queued frame when the queue is full, keeping latency bounded.
+    File sources block the reader instead (backpressure), so no frame is ever dropped.
+    """
+    def __init__(self, source: str, live: Optional[bool] = None, maxsize: int = config.CAPTURE_QUEUE_SIZE):
+        self.source = source
+        self.live = is_live_source(source) if live is None else live
+        self.maxsize = max(1, maxsize)
+        self.error: Optional[str] = None
+        self.on_frame: Optional[Callable[[], None]] = None  # Called from the capture thread after each frame
+
+        self._cap = cv2.VideoCapture(source)
+        if self.live:
+            # Keep the decoder's own buffer short; our queue does the buffering
+            self._cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+        self._ended = False
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name=f"capture-{source}", daemon=True)
+
+        self._frames_read = 0
+        self._frames_dropped = 0
+        self._frames_consumed = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def is_opened(self) -> bool:
+        return self._cap.isOpened()
+
+    @property
+    def fps(self) -> float:
+        return self._cap.get(cv2.CAP_PROP_FPS) or 0.0
+
+    def start(self) -> "FrameGrabber":
+        self._thread.start()
+        return self
+
+    def _run(self):
+        index = 0
+        try:
+            while not self._stopped:
+                success, frame = self._cap.read()
+                if not success:
+                    if self.live:
+                        self.error = "Video feed ended or failed."
+                    break
+                item = CapturedFrame(frame, index, time.monotonic())
+                index += 1
+                with self._cond:
+                    if self.live:
+                        if len(self._queue) >= self.maxsize:
+                            self._queue.popleft()
+                            self._frames_dropped += 1
+                    else:
+                        while len(self._queue) >= self.maxsize and not self._stopped:
+                            self._cond.wait()
+                    self._queue.append(item)
+                    self._frames_read += 1
+                    self._cond.notify_all()
+                if self.on_frame:
+                    self.on_frame()
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            self._cap.release()
+            with self._cond:
+                self._ended = True
+                self._cond.notify_all()
+            if self.on_frame:
+                self.on_frame()
+
+    def read(self, timeout: Optional[float] = None) -> Optional[CapturedFrame]:
+        """
+        Returns the oldest queued frame, waiting up to `timeout` seconds for one.
+        Returns None on timeout or once the source has ended and the queue is drained.
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._queue or self._ended, timeout):
+                return None
+            if not self._queue:
+                return None
+            item = self._queue.popleft()
+            self._cond.notify_all()
+            self._record_wait(item)
+        return item
+
+    def read_latest(self, timeout: Optional[float] = None) -> Optional[CapturedFrame]:
+        """
+        Like `read`, but for live sources skips straight to the newest queued frame,
+        counting the skipped ones as dropped. File sources behave exactly like `read`.
+        """
+        if not self.live:
+            return self.read(timeout)
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._queue or self._ended, timeout):
+                return None
+            if not self._queue:
+                return None
+            self._frames_dropped += len(self._queue) - 1
+            item = self._queue.pop()
+            self._queue.clear()
+            self._cond.notify_all()
+            self._record_wait(item)
+        return item
+
+    def _record_wait(self, item: CapturedFrame):
+        wait = time.monotonic() - item.captured_at
+        self._frames_consumed += 1
+        self._total_wait += wait
+        self._max_wait = max(self._max_wait, wait)
+
+    @property
+    def queued(self) -> int:
+        """Number of decoded frames waiting to be read."""
+        return len(self._queue)
+
+    @property
+    def ended(self) -> bool:
+        """True once the source has no more frames and everything queued was consumed."""
+        with self._cond:
+            return self._ended and not self._queue
+
+    def stats(self) -> CaptureStats:
+        with self._cond:
+            avg_wait = self._total_wait / self._frames_consumed if self._frames_consumed else 0.0
+            return CaptureStats(self._frames_read, self._frames_dropped, avg_wait, self._max_wait)
+
+    def stop(self):
+        """Stops the reader thread and releases the capture."""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._thread.ident is None:
+            self._cap.release()
+        elif self._thread.is_alive():
+            self._thread.join(timeout=5)
@@ -7,4 +7,84 @@ DATABASE_URL: str = os.getenv("DATABASE_URL")
 if DATABASE_URL is None:
     raise ValueError("FATAL: DATABASE_URL environment variable is not set.")
 
-MODEL_PATH: str = 'yolo11n.pt'
\ No newline at end of file
+MODEL_PATH: str = 'yolo11n.pt'
+MODEL_IMGSZ: int = int(os.getenv("MODEL_IMGSZ", "640"))  # Detector input size
+API_URL: str = os.getenv("API_URL", "http://127.0.0.1:8000")
+CONFIDENCE_THRESHOLD: float = float(os.getenv("CONFIDENCE_THRESHOLD", "0.3"))
+
+# --- Database ---
+DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "10"))  # Connections kept open per engine
+DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "20"))  # Extra connections opened under load, closed when returned
+DB_POOL_TIMEOUT: float = float(os.getenv("DB_POOL_TIMEOUT", "10.0"))  # Seconds to wait for a free connection
+DB_POOL_RECYCLE: int = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # Reconnect connections older than this many seconds
+DB_STATEMENT_TIMEOUT_MS: int = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "5000"))  # PostgreSQL statement_timeout, 0 disables
+DB_PREPARED_STATEMENT_CACHE_SIZE: int = int(os.getenv("DB_PREPARED_STATEMENT_CACHE_SIZE", "256"))  # Prepared statements kept per asyncpg connection
+DB_CREATE_SCHEMA_ON_STARTUP: bool = os.getenv("DB_CREATE_SCHEMA_ON_STARTUP", "true").lower() in ("1", "true", "yes")  # Set to false when `python database.py` runs as a deploy step
+
+# --- Event Ingestion ---
+EVENT_BUFFER_SIZE: int = int(os.getenv("EVENT_BUFFER_SIZE", "200"))  # Events per bulk insert
+EVENT_BUFFER_MAX_DELAY: float = float(os.getenv("EVENT_BUFFER_MAX_DELAY", "1.0"))  # Max seconds an event waits before a flush
+EVENT_BUFFER_RETRIES: int = int(os.getenv("EVENT_BUFFER_RETRIES", "3"))  # Retries before a batch is spilled to disk
+EVENT_SPILL_DIR: str = os.getenv("EVENT_SPILL_DIR", "event_spill")
+ROLLUP_BUCKET_SECONDS: int = int(os.getenv("ROLLUP_BUCKET_SECONDS", "60"))  # Width of the pre-aggregated stats buckets
+STATS_SUMMARY_TTL: float = float(os.getenv("STATS_SUMMARY_TTL", "5.0"))  # Seconds the all-areas summary is cached
+
+# --- Event Export ---
+EXPORT_CHUNK_SIZE: int = int(os.getenv("EXPORT_CHUNK_SIZE", "10000"))  # Rows fetched from the database cursor at a time
+EXPORT_MAX_PAGE_SIZE: int = int(os.getenv("EXPORT_MAX_PAGE_SIZE", "100000"))  # Largest `limit` accepted for paged exports
+
+# --- Live Event Stream ---
+LIVE_QUEUE_SIZE: int = int(os.getenv("LIVE_QUEUE_SIZE", "1000"))  # Messages buffered per subscriber before the oldest are dropped
+LIVE_KEEPALIVE_SECONDS: float = float(os.getenv("LIVE_KEEPALIVE_SECONDS", "15.0"))
+
+# --- Metrics ---
+WORKER_METRICS_PORT: int = int(os.getenv("WORKER_METRICS_PORT", "9101"))  # Port of the worker's /metrics endpoint, 0 disables
+METRICS_PUSH_INTERVAL: float = float(os.getenv("METRICS_PUSH_INTERVAL", "5.0"))  # Seconds between metric snapshots from stream processes
+
+# --- Live Preview ---
+PREVIEW_FPS: float = float(os.getenv("PREVIEW_FPS", "5.0"))  # Max preview frames per second per stream
+PREVIEW_WIDTH: int = int(os.getenv("PREVIEW_WIDTH", "960"))  # Preview frames are downscaled to this width
+PREVIEW_JPEG_QUALITY: int = int(os.getenv("PREVIEW_JPEG_QUALITY", "70"))
+PREVIEW_HOST: str = os.getenv("PREVIEW_HOST", "0.0.0.0")
+PREVIEW_PORT: int = int(os.getenv("PREVIEW_PORT", "8502"))  # Port of the dashboard's preview server
+PREVIEW_URL: str = os.getenv("PREVIEW_URL", "http://localhost:8502")  # Preview server address as seen by the browser
+
+# --- Frame Capture ---
+CAPTURE_QUEUE_SIZE: int = int(os.getenv("CAPTURE_QUEUE_SIZE", "4"))  # Decoded frames buffered between capture and inference
+CAPTURE_STATS_INTERVAL: float = float(os.getenv("CAPTURE_STATS_INTERVAL", "30.0"))  # Seconds between capture stats log lines
+
+# --- Headless Worker ---
+WORKER_RESTART_DELAY: float = float(os.getenv("WORKER_RESTART_DELAY", "2.0"))  # Seconds before restarting a dead stream
+WORKER_MAX_RESTART_DELAY: float = float(os.getenv("WORKER_MAX_RESTART_DELAY", "60.0"))
+WORKER_SHUTDOWN_TIMEOUT: float = float(os.getenv("WORKER_SHUTDOWN_TIMEOUT", "10.0"))
+WORKER_STREAMS_PER_PROCESS: int = int(os.getenv("WORKER_STREAMS_PER_PROCESS", "1"))  # Streams sharing one detector
+WORKER_PREVIEW_PORT: int = int(os.getenv("WORKER_PREVIEW_PORT", "0"))  # Preview port of the first stream process, 0 disables
+
+# --- Recorded Files ---
+RECORDING_WORKERS: int = int(os.getenv("RECORDING_WORKERS", "0"))  # Processes counting segments in parallel, 0 uses every core
+RECORDING_THREADS_PER_WORKER: int = int(os.getenv("RECORDING_THREADS_PER_WORKER", "2"))  # Inference threads per process
+RECORDING_SEGMENT_SECONDS: float = float(os.getenv("RECORDING_SEGMENT_SECONDS", "120.0"))  # Video length handed to one process at a time
+RECORDING_OVERLAP_SECONDS: float = float(os.getenv("RECORDING_OVERLAP_SECONDS", "4.0"))  # Lead-in tracked before each segment, for stitching
+RECORDING_STITCH_IOU: float = float(os.getenv("RECORDING_STITCH_IOU", "0.5"))  # Min overlap score for two tracks to be the same person
+
+# --- Zone Counting ---
+ZONE_HYSTERESIS_PX: int = int(os.getenv("ZONE_HYSTERESIS_PX", "8"))  # How far past an edge a person must be to switch sides
+ZONE_MIN_DWELL_FRAMES: int = int(os.getenv("ZONE_MIN_DWELL_FRAMES", "3"))  # Frames the new side must hold before an event
+ZONE_TRACK_TTL_FRAMES: int = int(os.getenv("ZONE_TRACK_TTL_FRAMES", "300"))  # Forget tracks not seen for this many frames
+ZONE_MAX_TRACKS: int = int(os.getenv("ZONE_MAX_TRACKS", "10000"))  # Hard cap on remembered tracks per stream
+
+# --- Inference ---
+TRACKER_CONFIG: str = os.getenv("TRACKER_CONFIG", "bytetrack.yaml")
+INFERENCE_BATCH_SIZE: int = int(os.getenv("INFERENCE_BATCH_SIZE", "8"))  # Max frames per detector call
+INFERENCE_MAX_WAIT: float = float(os.getenv("INFERENCE_MAX_WAIT", "0.02"))  # Seconds to wait for a batch to fill
+ADAPTIVE_STRIDE: bool = os.getenv("ADAPTIVE_STRIDE", "false").lower() in ("1", "true", "yes")  # Detect every k-th frame, predict the rest
+STRIDE_MAX: int = int(os.getenv("STRIDE_MAX", "4"))  # Largest k the adaptive stride may pick
+STRIDE_TARGET_LOAD: float = float(os.getenv("STRIDE_TARGET_LOAD", "0.8"))  # Share of real time the detector may use
+INFERENCE_BACKEND: str = os.getenv("INFERENCE_BACKEND", "torch")  # torch, onnxruntime or openvino
+INFERENCE_INT8: bool = os.getenv("INFERENCE_INT8", "false").lower() in ("1", "true", "yes")  # Quantize the export to INT8
+INFERENCE_CALIBRATION_SOURCE: str = os.getenv("INFERENCE_CALIBRATION_SOURCE", "")  # Video or image folder for INT8 calibration
+INFERENCE_CALIBRATION_FRAMES: int = int(os.getenv("INFERENCE_CALIBRATION_FRAMES", "100"))
+ROI_CROP: bool = os.getenv("ROI_CROP", "false").lower() in ("1", "true", "yes")  # Only detect around the monitored polygons
+ROI_PADDING: float = float(os.getenv("ROI_PADDING", "0.05"))  # Crop padding around the polygons, as a fraction of frame height
+ROI_TOP_PADDING: float = float(os.getenv("ROI_TOP_PADDING", "0.25"))  # Extra room above the polygons for people standing in them
+ROI_MIN_SIZE: int = int(os.getenv("ROI_MIN_SIZE", "320"))  # Smallest crop width/height in pixels
\ No newline at end of file
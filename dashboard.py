@@ -6,19 +6,27 @@ import pandas as pd
 from PIL import Image
 from ultralytics import YOLO
 from streamlit_drawable_canvas import st_canvas
+import datetime
+import functools
 import os
+import time
+import uuid
 
 # Import project modules
 import config
-from database import SessionLocal, CountingEvent
+from event_buffer import EventBuffer
+from capture import FrameGrabber
+from inference import Detector
+from pipeline import StreamCounter, clean_polygon, extract_tracks, load_model
+from preview import PreviewServer, PreviewStream
+from recordings import count_recording
 
 # --- Page and App Configuration ---
 st.set_page_config(layout="wide", page_title="People Counting Dashboard")
 st.title("People Counting System High-Risk Area Monitoring System")
 
 # --- Constants ---
-API_URL = os.getenv("API_URL", "http://127.0.0.1:8000")
-DB_COMMIT_BATCH_SIZE = 5  # Number of events to batch before committing to DB
+API_URL = config.API_URL
 
 # --- API Helper Functions ---
 def get_areas():
@@ -30,14 +38,14 @@ def get_areas():
     except requests.RequestException:
         return []
 
-def get_stats(area_id):
-    """Fetches lifetime statistics for a given area."""
+def get_stats_summary():
+    """Fetches lifetime statistics for all areas in a single request."""
     try:
-        res = requests.get(f"{API_URL}/api/stats/{area_id}")
+        res = requests.get(f"{API_URL}/api/stats/summary")
         res.raise_for_status()
         return res.json()
     except requests.RequestException:
-        return {"entries": 0, "exits": 0}
+        return []
 
 def save_area_to_api(area_name, coordinates):
     """Sends a new area to the backend API to be saved."""
@@ -65,9 +73,14 @@ def delete_area_from_api(area_id: int):
 
 # --- Cached Resources ---
 @st.cache_resource
-def load_yolo_model(model_path: str) -> YOLO:
-    """Loads the YOLO model from the specified path, caching it for performance."""
-    return YOLO(model_path)
+def load_yolo_model(model_path: str, backend: str = config.INFERENCE_BACKEND, int8: bool = config.INFERENCE_INT8) -> YOLO:
+    """Loads the YOLO model for the configured inference backend, caching it for performance."""
+    return load_model(model_path, backend, int8)
+
+@st.cache_resource
+def get_preview_server() -> PreviewServer:
+    """Starts the preview server shared by all dashboard sessions."""
+    return PreviewServer(port=config.PREVIEW_PORT).start()
 
 # --- Session State Initialization ---
 if 'processing' not in st.session_state:
@@ -76,6 +89,8 @@ if 'page' not in st.session_state:
     st.session_state.page = "Live Processor"
 if 'config_frame' not in st.session_state:
     st.session_state.config_frame = None
+if 'preview_key' not in st.session_state:
+    st.session_state.preview_key = uuid.uuid4().hex
 
 def stop_processing():
     """Callback function to stop processing when a new file is uploaded."""
@@ -126,7 +141,19 @@ if st.session_state.page == "Live Processor":
             "Detection Confidence Threshold", 
             min_value=0.0, max_value=1.0, value=0.3, step=0.05
         )
-        st.write("")
+        show_preview = st.checkbox(
+            "Show live preview", value=True,
+            help=f"Annotated preview at up to {config.PREVIEW_FPS:g} fps. Counting runs at full speed either way."
+        )
+        batch_mode = False
+        if source_type == "File Upload":
+            batch_mode = st.checkbox(
+                "Fast batch mode", value=False,
+                help="Count the whole recording in parallel on every CPU core instead of playing it back. Events are timestamped from the video."
+            )
+            if batch_mode:
+                recording_date = st.date_input("Recording start date")
+                recording_time = st.time_input("Recording start time", step=60)
         st.write("")
 
     if video_source:
@@ -139,15 +166,19 @@ if st.session_state.page == "Live Processor":
                 st.session_state.processing = False
                 st.rerun()
 
+        if 'batch_result' in st.session_state:
+            st.success(st.session_state.pop('batch_result'))
+
         stframe = st.empty()
+        stcounts = st.empty()
         if not st.session_state.processing and source_type == "File Upload" and 'uploaded_file' in locals() and uploaded_file:
             stframe.video(uploaded_file)
         
         if st.session_state.processing:
-            with st.spinner(f"Loading YOLO model from '{config.MODEL_PATH}'..."):
-                model = load_yolo_model(config.MODEL_PATH)
+            if not batch_mode:
+                with st.spinner(f"Loading YOLO model from '{config.MODEL_PATH}' ({config.INFERENCE_BACKEND})..."):
+                    model = load_yolo_model(config.MODEL_PATH)
 
-            db = SessionLocal()
             selected_area_id = area_options[selected_area_name]
             area_config = next((area for area in areas if area['id'] == selected_area_id), None)
 
@@ -155,61 +186,73 @@ if st.session_state.page == "Live Processor":
                 st.error(f"Could not load configuration for area '{selected_area_name}'.")
                 st.stop()
 
-            raw_coords = area_config['coordinates']
-            clean_coords = [c for c in raw_coords if isinstance(c, (list, tuple)) and len(c) == 2]
-            
-            if len(clean_coords) < 3:
+            polygon_coords = clean_polygon(area_config['coordinates'])
+            if polygon_coords is None:
                 st.error(f"The selected area '{selected_area_name}' has invalid polygon data (fewer than 3 points). Please delete and re-create it.")
                 st.stop() 
 
-            polygon_coords = np.array(clean_coords, np.int32)
-            cap = cv2.VideoCapture(video_source)
-            person_positions, entry_count, exit_count = {}, 0, 0
-            events_to_commit = []
-            while cap.isOpened() and st.session_state.processing:
-                success, frame = cap.read()
-                if not success:
-                    st.warning("Video feed ended or failed.")
-                    break
-                
-                results = model.track(frame, persist=True, classes=0, conf=confidence_threshold, verbose=False)
-                annotated_frame = results[0].plot()
-                cv2.polylines(annotated_frame, [polygon_coords], isClosed=True, color=(0, 0, 255), thickness=3)
-                
-                if results[0].boxes.id is not None:
-                    boxes = results[0].boxes.xyxy.cpu().numpy().astype(int)
-                    track_ids = results[0].boxes.id.cpu().numpy().astype(int)
-
-                    for box, track_id in zip(boxes, track_ids):
-                        bottom_center = (int((box[0] + box[2]) / 2), int(box[3]))
-                        is_inside = cv2.pointPolygonTest(polygon_coords, bottom_center, False) >= 0
-                        was_inside = person_positions.get(track_id, False)
-
-                        if not was_inside and is_inside:
-                            entry_count += 1
-                            events_to_commit.append(CountingEvent(area_id=selected_area_id, event_type='entry', tracker_id=int(track_id)))
-                        elif was_inside and not is_inside:
-                            exit_count += 1
-                            events_to_commit.append(CountingEvent(area_id=selected_area_id, event_type='exit', tracker_id=int(track_id)))
-                        
-                        person_positions[track_id] = is_inside
-                        
-                        if len(events_to_commit) >= DB_COMMIT_BATCH_SIZE:
-                            db.add_all(events_to_commit)
-                            db.commit()
-                            events_to_commit.clear()
-                
-                cv2.putText(annotated_frame, f'Entries: {entry_count}', (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2, cv2.LINE_AA)
-                cv2.putText(annotated_frame, f'Exits: {exit_count}', (50, 90), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 0, 0), 2, cv2.LINE_AA)
-                
-                stframe.image(cv2.cvtColor(annotated_frame, cv2.COLOR_BGR2RGB))
-            
-            if events_to_commit:
-                db.add_all(events_to_commit)
-                db.commit()
+            if batch_mode:
+                # The recording is split into segments counted by a pool of processes; see recordings.py
+                start_time = datetime.datetime.combine(recording_date, recording_time).astimezone()
+                progress_bar = st.progress(0.0, text="Counting the recording...")
+                events = EventBuffer(f"dashboard-batch-{uuid.uuid4().hex[:12]}")
+                try:
+                    counter = count_recording(
+                        video_source, {selected_area_id: polygon_coords}, start_time, events,
+                        detector_factory=functools.partial(Detector, conf=confidence_threshold),
+                        progress=lambda done: progress_bar.progress(done, text=f"Counting the recording... {done:.0%}"),
+                    )
+                finally:
+                    events.close(timeout=60)
+                st.session_state.batch_result = (
+                    f"Counted {counter.entry_counts[selected_area_id]} entries and "
+                    f"{counter.exit_counts[selected_area_id]} exits in the recording."
+                )
+                st.session_state.processing = False
+                st.rerun()
+
+            grabber = FrameGrabber(video_source, live=source_type != "File Upload").start()
+            counter = StreamCounter({selected_area_id: polygon_coords})
+            # One buffer (and spill file) per run, so concurrent sessions never replay each other's spills
+            events = EventBuffer(f"dashboard-{uuid.uuid4().hex[:12]}")
+
+            # The browser pulls the annotated frames straight from the preview server, so
+            # nothing is drawn or encoded here unless someone has the preview open.
+            preview_server = get_preview_server()
+            preview_key = st.session_state.preview_key
+            preview = PreviewStream(counter.polygons)
+            preview_server.add_stream(preview_key, preview)
+            if show_preview:
+                stframe.markdown(
+                    f'<img src="{config.PREVIEW_URL}/streams/{preview_key}.mjpg?t={time.time():.0f}" style="width:100%">',
+                    unsafe_allow_html=True,
+                )
+            else:
+                stframe.empty()
+            shown_counts = None
+            try:
+                while st.session_state.processing:
+                    captured = grabber.read()
+                    if captured is None:
+                        st.warning(grabber.error or "Video feed ended or failed.")
+                        break
+
+                    results = model.track(captured.frame, persist=True, classes=0, conf=confidence_threshold, verbose=False)
+                    boxes, track_ids = extract_tracks(results[0])
+                    for event in counter.update(boxes, track_ids):
+                        events.add(event.area_id, event.event_type, event.tracker_id)
+                    if preview.watched:
+                        preview.publish(captured.frame, boxes, track_ids, counter.entry_counts, counter.exit_counts)
+
+                    counts = (counter.entry_counts[selected_area_id], counter.exit_counts[selected_area_id])
+                    if counts != shown_counts:
+                        stcounts.markdown(f"**Entries:** {counts[0]} &nbsp;&nbsp; **Exits:** {counts[1]}")
+                        shown_counts = counts
+            finally:
+                preview_server.remove_stream(preview_key)
+                grabber.stop()
+                events.close(timeout=10)
 
-            cap.release()
-            db.close()
             st.success("Processing stopped.")
             st.session_state.processing = False
             st.rerun()
@@ -224,24 +267,23 @@ elif st.session_state.page == "Statistics & Management":
     if st.button("Refresh Data 🔄"):
         st.rerun()
 
-    areas = get_areas()
-    if not areas:
+    area_stats = get_stats_summary()
+    if not area_stats:
         st.info("No areas found. Use the configuration tool below to create one.")
     else:
-        for area in areas:
+        for stats in area_stats:
             with st.container():
                 c1, c2, c3, c4 = st.columns([4, 2, 2, 1])
                 with c1:
-                    st.subheader(area['name'])
+                    st.subheader(stats['name'])
                 
-                stats = get_stats(area['id'])
                 with c2:
                     st.metric("Total Entries", stats.get('entries', 'N/A'))
                 with c3:
                     st.metric("Total Exits", stats.get('exits', 'N/A'))
                 with c4:
-                    if st.button(f"❌ Delete", key=f"delete_{area['id']}", type="secondary", use_container_width=True):
-                        if delete_area_from_api(area['id']):
+                    if st.button(f"❌ Delete", key=f"delete_{stats['area_id']}", type="secondary", use_container_width=True):
+                        if delete_area_from_api(stats['area_id']):
                             st.rerun()
                 st.divider()
 
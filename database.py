@@ -1,15 +1,64 @@
-import datetime
+import functools
 from sqlalchemy.sql import func
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, JSON, ForeignKey
+from sqlalchemy import create_engine, make_url, Column, Integer, String, DateTime, JSON, ForeignKey, Index
+from sqlalchemy.engine import URL
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, relationship
 from sqlalchemy.ext.declarative import declarative_base
 import config
 
+ASYNC_DRIVERS = {"postgresql": "asyncpg", "sqlite": "aiosqlite"}
+
+def _pool_options(url: URL) -> dict:
+    """Pool settings from the config. SQLite keeps SQLAlchemy's defaults, which suit a local file."""
+    if url.get_backend_name() == "sqlite":
+        return {}
+    return {
+        "pool_size": config.DB_POOL_SIZE,
+        "max_overflow": config.DB_MAX_OVERFLOW,
+        "pool_timeout": config.DB_POOL_TIMEOUT,
+        "pool_recycle": config.DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+
+def async_url(url: str) -> URL:
+    """The asyncio driver's variant of a database URL, e.g. postgresql+asyncpg:// for postgresql://."""
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No asyncio driver is configured for '{backend}' databases.")
+    url = url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}")
+    if backend == "postgresql":
+        # asyncpg prepares every statement; keep the most used ones per connection for reuse
+        url = url.update_query_dict({"prepared_statement_cache_size": str(config.DB_PREPARED_STATEMENT_CACHE_SIZE)})
+    return url
+
 # Engine setup using the configuration file
-engine = create_engine(config.DATABASE_URL)
+_url = make_url(config.DATABASE_URL)
+_connect_args = {}
+if _url.get_backend_name() == "postgresql" and config.DB_STATEMENT_TIMEOUT_MS > 0:
+    _connect_args["options"] = f"-c statement_timeout={config.DB_STATEMENT_TIMEOUT_MS}"
+engine = create_engine(_url, connect_args=_connect_args, **_pool_options(_url))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+@functools.lru_cache(maxsize=None)
+def get_async_engine() -> AsyncEngine:
+    """
+    The asyncio engine the API serves reads and ingestion from. Created on first use, so
+    scripts that only use the sync engine don't need the async driver installed.
+    """
+    url = async_url(config.DATABASE_URL)
+    connect_args = {}
+    if url.get_backend_name() == "postgresql" and config.DB_STATEMENT_TIMEOUT_MS > 0:
+        connect_args["server_settings"] = {"statement_timeout": str(config.DB_STATEMENT_TIMEOUT_MS)}
+    return create_async_engine(url, connect_args=connect_args, **_pool_options(url))
+
+@functools.lru_cache(maxsize=None)
+def get_async_sessionmaker() -> async_sessionmaker:
+    # Objects stay readable after commit without another round trip
+    return async_sessionmaker(get_async_engine(), autoflush=False, expire_on_commit=False)
+
 class Area(Base):
     """
     Represents a monitored area (polygon) in the system.
@@ -19,6 +68,7 @@ class Area(Base):
     name = Column(String, unique=True, index=True, nullable=False)
     coordinates = Column(JSON, nullable=False)
     events = relationship("CountingEvent", back_populates="area", cascade="all, delete-orphan")
+    rollups = relationship("CountingRollup", cascade="all, delete-orphan")
 
 class CountingEvent(Base):
     """
@@ -31,13 +81,42 @@ class CountingEvent(Base):
     event_type = Column(String, nullable=False) # 'entry' or 'exit'
     tracker_id = Column(Integer)
     area = relationship("Area", back_populates="events")
+    __table_args__ = (
+        Index("ix_counting_events_area_type_timestamp", "area_id", "event_type", "timestamp"),
+        Index("ix_counting_events_area_timestamp_id", "area_id", "timestamp", "id"),  # Export order and cursors
+        Index("ix_counting_events_timestamp_id", "timestamp", "id"),  # Exports across all areas
+    )
+
+class CountingRollup(Base):
+    """
+    Number of events per area, event type and time bucket (config.ROLLUP_BUCKET_SECONDS).
+    Maintained on ingestion so statistics don't have to scan the raw events.
+    """
+    __tablename__ = "counting_rollups"
+    area_id = Column(Integer, ForeignKey("areas.id", ondelete="CASCADE"), primary_key=True)
+    event_type = Column(String, primary_key=True)
+    bucket_start = Column(DateTime(timezone=True), primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+def _create_schema(connection):
+    Base.metadata.create_all(bind=connection)
+    # create_all skips tables that already exist, so add indexes introduced later explicitly
+    for index in CountingEvent.__table__.indexes:
+        index.create(bind=connection, checkfirst=True)
 
 def create_db_and_tables():
     """
     Creates all database tables defined by the Base metadata.
     This is idempotent - it won't re-create existing tables.
     """
-    Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        _create_schema(connection)
+    print("Database and tables checked/created successfully.")
+
+async def create_db_and_tables_async():
+    """create_db_and_tables over the asyncio engine, for the API's startup."""
+    async with get_async_engine().begin() as connection:
+        await connection.run_sync(_create_schema)
     print("Database and tables checked/created successfully.")
 
 if __name__ == "__main__":
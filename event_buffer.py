@@ -0,0 +1,227 @@
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+from typing import List, Optional
+
+import requests
+
+import config
+import metrics
+
+logger = logging.getLogger(__name__)
+
+FLUSH_SECONDS = metrics.histogram(
+    "people_counter_event_flush_seconds", "Time to send one batch of events to the API, including retries.", ["buffer"],
+)
+PENDING = metrics.gauge("people_counter_event_buffer_pending", "Events waiting to be sent.", ["buffer"])
+SENT = metrics.counter("people_counter_events_sent_total", "Events delivered to the API.", ["buffer"])
+SPILLED = metrics.counter("people_counter_events_spilled_total", "Events written to the spill file.", ["buffer"])
+
+def _ends_with_newline(path: str) -> bool:
+    """True for a missing or empty file, or one whose last line is complete."""
+    if not os.path.exists(path) or not os.path.getsize(path):
+        return True
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+class EventBuffer:
+    """
+    Write-behind buffer that ships counting events to the API's bulk endpoint from a background thread,
+    so the video loop never waits on the database.
+
+    Events are flushed once `max_size` are pending or `max_delay` seconds after the oldest one was added.
+    A failed flush is retried with backoff; if the API stays unreachable, the batch is appended to a local
+    spill file and replayed after the next successful flush.
+    """
+    def __init__(
+        self,
+        name: str,
+        api_url: str = config.API_URL,
+        max_size: int = config.EVENT_BUFFER_SIZE,
+        max_delay: float = config.EVENT_BUFFER_MAX_DELAY,
+        retries: int = config.EVENT_BUFFER_RETRIES,
+        spill_dir: str = config.EVENT_SPILL_DIR,
+    ):
+        self.url = f"{api_url}/api/events/batch"
+        self.max_size = max(1, max_size)
+        self.max_delay = max_delay
+        self.retries = retries
+        self.spill_path = os.path.join(spill_dir, f"events-{name}.jsonl")
+        self.name = name
+
+        self._session = requests.Session()
+        self._pending: List[dict] = []
+        self._oldest_at = 0.0
+        self._in_flight = 0
+        self._closing = False
+        self._cond = threading.Condition()
+        PENDING.labels(name).set_function(lambda: len(self._pending))
+        self._recover_interrupted_replay()
+        self._thread = threading.Thread(target=self._run, name=f"event-buffer-{name}", daemon=True)
+        self._thread.start()
+
+    def add(self, area_id: int, event_type: str, tracker_id: Optional[int] = None, timestamp: Optional[datetime.datetime] = None):
+        """Queues an event. Never blocks on the network."""
+        timestamp = timestamp or datetime.datetime.now(datetime.timezone.utc)
+        event = {"area_id": area_id, "event_type": event_type, "tracker_id": tracker_id, "timestamp": timestamp.isoformat()}
+        with self._cond:
+            if not self._pending:
+                self._oldest_at = time.monotonic()
+            self._pending.append(event)
+            if len(self._pending) >= self.max_size:
+                self._cond.notify_all()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Asks the background thread to send everything now and waits until it has. Returns False on timeout."""
+        with self._cond:
+            self._oldest_at = float("-inf")
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: not self._pending and not self._in_flight, timeout)
+
+    def close(self, timeout: Optional[float] = None):
+        """Flushes pending events and stops the background thread."""
+        with self._cond:
+            self._closing = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        self._session.close()
+
+    def _due(self) -> bool:
+        if not self._pending:
+            return False
+        return self._closing or len(self._pending) >= self.max_size or time.monotonic() - self._oldest_at >= self.max_delay
+
+    def _run(self):
+        self._try_replay_spill()  # Leftovers from a previous run
+        while True:
+            with self._cond:
+                while not self._due() and not self._closing:
+                    timeout = None
+                    if self._pending:
+                        timeout = max(0.0, self._oldest_at + self.max_delay - time.monotonic())
+                    self._cond.wait(timeout)
+                if not self._pending and self._closing:
+                    return
+                batch = self._pending[:self.max_size]
+                del self._pending[:self.max_size]
+                if self._pending:
+                    self._oldest_at = time.monotonic()
+                self._in_flight = len(batch)
+
+            try:
+                started = time.perf_counter()
+                sent = self._send_with_retries(batch)
+                FLUSH_SECONDS.labels(self.name).observe(time.perf_counter() - started)
+                if sent:
+                    SENT.labels(self.name).inc(len(batch))
+                    self._try_replay_spill()
+                else:
+                    self._spill(batch)
+            finally:
+                with self._cond:
+                    self._in_flight = 0
+                    self._cond.notify_all()
+
+    def _send(self, events: List[dict]):
+        """Posts a batch. Raises on network errors and 5xx; drops batches the API rejects as invalid."""
+        res = self._session.post(self.url, json={"events": events}, timeout=10)
+        if 400 <= res.status_code < 500:
+            logger.error("API rejected %d events (%s): %s", len(events), res.status_code, res.text)
+            return
+        res.raise_for_status()
+
+    def _send_with_retries(self, events: List[dict]) -> bool:
+        # While a spill file exists the API was recently down; don't stall new events behind retries
+        attempts = 1 if os.path.exists(self.spill_path) else self.retries + 1
+        for attempt in range(attempts):
+            try:
+                self._send(events)
+                return True
+            except requests.RequestException as e:
+                if attempt + 1 < attempts and not self._closing:
+                    delay = 0.5 * 2 ** attempt
+                    logger.warning("Failed to send %d events (%s); retrying in %.1fs.", len(events), e, delay)
+                    time.sleep(delay)
+                else:
+                    logger.warning("Failed to send %d events (%s).", len(events), e)
+        return False
+
+    def _write_spill(self, events: List[dict]):
+        """Appends `events` to the spill file without counting them as newly spilled."""
+        os.makedirs(os.path.dirname(self.spill_path) or ".", exist_ok=True)
+        with open(self.spill_path, "a") as f:
+            if not _ends_with_newline(self.spill_path):
+                f.write("\n")  # Don't glue the first event onto a line torn by a crash
+            for event in events:
+                f.write(json.dumps(event) + "\n")
+
+    def _spill(self, events: List[dict]):
+        self._write_spill(events)
+        SPILLED.labels(self.name).inc(len(events))
+        logger.warning("Spilled %d events to '%s'.", len(events), self.spill_path)
+
+    def _recover_interrupted_replay(self):
+        """Moves events left behind by a replay that was interrupted (e.g. a crash) back into the spill file."""
+        replay_path = self.spill_path + ".replay"
+        if not os.path.exists(replay_path):
+            return
+        with open(replay_path) as src, open(self.spill_path, "a") as dst:
+            content = src.read()
+            if not _ends_with_newline(self.spill_path):
+                dst.write("\n")
+            dst.write(content if not content or content.endswith("\n") else content + "\n")
+        os.remove(replay_path)
+
+    def _try_replay_spill(self):
+        """Replays the spill file without ever ending the sender thread; a failed replay is retried after the next flush."""
+        try:
+            self._replay_spill()
+        except Exception:
+            logger.exception("Replaying spilled events from '%s' failed.", self.spill_path)
+
+    def _read_spill(self, path: str) -> List[dict]:
+        """
+        Reads spilled events. Lines that don't parse, e.g. torn by a crash in the middle of `_spill`,
+        are moved to a `.bad` file next to the spill file instead of blocking the rest.
+        """
+        events, bad = [], []
+        with open(path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    events.append(json.loads(line))
+                except ValueError:
+                    bad.append(line if line.endswith("\n") else line + "\n")
+        if bad:
+            with open(self.spill_path + ".bad", "a") as f:
+                f.writelines(bad)
+            logger.warning("Skipped %d unreadable lines of '%s'; kept them in '%s.bad'.", len(bad), path, self.spill_path)
+        return events
+
+    def _replay_spill(self):
+        """Sends spilled events in batches. Whatever can't be sent stays in the spill file."""
+        if not os.path.exists(self.spill_path):
+            return
+        replay_path = self.spill_path + ".replay"
+        os.replace(self.spill_path, replay_path)
+        events = self._read_spill(replay_path)
+
+        sent = 0
+        try:
+            for start in range(0, len(events), self.max_size):
+                self._send(events[start:start + self.max_size])
+                sent = start + self.max_size
+        except requests.RequestException as e:
+            logger.warning("Replaying spilled events failed (%s); will retry later.", e)
+        finally:
+            if sent < len(events):
+                self._write_spill(events[sent:])  # Already counted when they were first spilled
+            os.remove(replay_path)
+        if sent:
+            SENT.labels(self.name).inc(min(sent, len(events)))
+            logger.info("Replayed %d spilled events.", min(sent, len(events)))
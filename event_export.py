@@ -0,0 +1,164 @@
+"""
+Export of raw counting events as CSV, NDJSON or Parquet.
+
+Events are always read in (timestamp, id) order, which doubles as the key for paging: a
+cursor holds the (timestamp, id) of the last event of a page, and the next page starts
+right after it. Unlike OFFSET, that costs the same on the first page and the thousandth,
+and pages don't shift while new events are ingested.
+
+Encoders turn chunks of rows into bytes one chunk at a time, so a whole export can be
+streamed from a server-side cursor with flat memory use.
+"""
+import base64
+import binascii
+import csv
+import datetime
+import io
+import json
+from typing import Optional, Sequence, Tuple
+
+from sqlalchemy import Select, select, tuple_
+
+import database
+import rollups
+
+Event = database.CountingEvent
+COLUMNS = ("id", "area_id", "event_type", "tracker_id", "timestamp")
+MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+def events_query(
+    area_id: Optional[int] = None,
+    start: Optional[datetime.datetime] = None,
+    end: Optional[datetime.datetime] = None,
+    after: Optional[Tuple[datetime.datetime, int]] = None,
+    limit: Optional[int] = None,
+) -> Select:
+    """Events with start <= timestamp < end, after the (timestamp, id) cursor `after`, in (timestamp, id) order."""
+    stmt = select(Event.id, Event.area_id, Event.event_type, Event.tracker_id, Event.timestamp)
+    if area_id is not None:
+        stmt = stmt.where(Event.area_id == area_id)
+    if start is not None:
+        stmt = stmt.where(Event.timestamp >= rollups.as_utc(start))
+    if end is not None:
+        stmt = stmt.where(Event.timestamp < rollups.as_utc(end))
+    if after is not None:
+        stmt = stmt.where(tuple_(Event.timestamp, Event.id) > tuple_(rollups.as_utc(after[0]), after[1]))
+    stmt = stmt.order_by(Event.timestamp, Event.id)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    return stmt
+
+def encode_cursor(timestamp: datetime.datetime, event_id: int) -> str:
+    raw = f"{rollups.as_utc(timestamp).isoformat()}|{event_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime.datetime, int]:
+    """Returns the (timestamp, id) of an `encode_cursor` token. Raises ValueError for anything else."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        timestamp, event_id = raw.rsplit("|", 1)
+        return rollups.as_utc(datetime.datetime.fromisoformat(timestamp)), int(event_id)
+    except (ValueError, UnicodeDecodeError, binascii.Error) as e:
+        raise ValueError(f"Invalid cursor '{cursor}'.") from e
+
+def _timestamp(row) -> str:
+    return rollups.as_utc(row.timestamp).isoformat()
+
+class CsvEncoder:
+    def begin(self) -> bytes:
+        return self._write([COLUMNS])
+
+    def encode(self, rows: Sequence) -> bytes:
+        return self._write([(row.id, row.area_id, row.event_type, row.tracker_id, _timestamp(row)) for row in rows])
+
+    def end(self) -> bytes:
+        return b""
+
+    def _write(self, rows) -> bytes:
+        out = io.StringIO()
+        csv.writer(out).writerows(rows)
+        return out.getvalue().encode()
+
+class NdjsonEncoder:
+    def begin(self) -> bytes:
+        return b""
+
+    def encode(self, rows: Sequence) -> bytes:
+        return "".join(
+            json.dumps({"id": row.id, "area_id": row.area_id, "event_type": row.event_type, "tracker_id": row.tracker_id, "timestamp": _timestamp(row)}) + "\n"
+            for row in rows
+        ).encode()
+
+    def end(self) -> bytes:
+        return b""
+
+class _Drain(io.RawIOBase):
+    """Write-only file that hands out whatever was written since the last `drain`."""
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+class ParquetEncoder:
+    """Writes every chunk as its own row group, so the file can be sent while it is being written."""
+    def __init__(self):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as e:
+            raise RuntimeError("Parquet export needs extra packages: pip install pyarrow") from e
+        self._pa = pyarrow
+        self._schema = pyarrow.schema([
+            ("id", pyarrow.int64()),
+            ("area_id", pyarrow.int64()),
+            ("event_type", pyarrow.string()),
+            ("tracker_id", pyarrow.int64()),
+            ("timestamp", pyarrow.timestamp("us", tz="UTC")),
+        ])
+        self._sink = _Drain()
+        self._writer = pyarrow.parquet.ParquetWriter(self._sink, self._schema)
+
+    def begin(self) -> bytes:
+        return self._sink.drain()
+
+    def encode(self, rows: Sequence) -> bytes:
+        if not rows:
+            return b""
+        columns = {
+            "id": [row.id for row in rows],
+            "area_id": [row.area_id for row in rows],
+            "event_type": [row.event_type for row in rows],
+            "tracker_id": [row.tracker_id for row in rows],
+            "timestamp": [rollups.as_utc(row.timestamp) for row in rows],
+        }
+        self._writer.write_table(self._pa.table(columns, schema=self._schema))
+        return self._sink.drain()
+
+    def end(self) -> bytes:
+        self._writer.close()  # Writes the footer
+        return self._sink.drain()
+
+ENCODERS = {"csv": CsvEncoder, "ndjson": NdjsonEncoder, "parquet": ParquetEncoder}
+
+def make_encoder(fmt: str):
+    """Returns a new encoder for `fmt`. Raises RuntimeError if the format's optional package is missing."""
+    return ENCODERS[fmt]()
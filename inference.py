@@ -0,0 +1,239 @@
+import math
+import threading
+import time
+from typing import Callable, Dict, Hashable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+import config
+import metrics
+from capture import CapturedFrame, FrameGrabber
+from pipeline import load_model
+from roi import RegionOfInterest
+from stride import AdaptiveStride, TrackPropagator
+
+STAGE_SECONDS = metrics.histogram(
+    "people_counter_stage_seconds", "Time a frame spent in each pipeline stage.", ["stream", "stage"],
+)
+FRAMES = metrics.counter(
+    "people_counter_frames_total", "Frames processed, by whether the detector ran on them.", ["stream", "mode"],
+)
+BATCH_SECONDS = metrics.histogram("people_counter_inference_batch_seconds", "Wall time of one detector call.")
+BATCH_SIZE = metrics.histogram(
+    "people_counter_inference_batch_size", "Frames per detector call.", buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+STRIDE = metrics.gauge("people_counter_stride", "Current detection stride of a stream.", ["stream"])
+
+class TrackedFrame(NamedTuple):
+    """The tracking result for one frame of one stream."""
+    stream: Hashable
+    captured: CapturedFrame
+    boxes: np.ndarray  # (N, 4) int xyxy
+    track_ids: np.ndarray  # (N,) int
+    detected: bool  # False if the boxes were predicted on a frame the detector skipped
+
+class Detector:
+    """
+    Runs person detection on a batch of frames.
+    Unlike `model.track`, it keeps no tracker state, so one instance can serve many streams.
+    """
+    def __init__(
+        self,
+        model_path: str = config.MODEL_PATH,
+        conf: float = config.CONFIDENCE_THRESHOLD,
+        imgsz: int = config.MODEL_IMGSZ,
+        device: Optional[str] = None,
+        backend: str = config.INFERENCE_BACKEND,
+        int8: bool = config.INFERENCE_INT8,
+    ):
+        self.model = load_model(model_path, backend, int8)
+        self.backend = backend
+        self.conf = conf
+        self.imgsz = imgsz
+        self.device = device  # e.g. "cpu" or "0"; None lets ultralytics pick
+
+    def detect(self, frames: List[np.ndarray], rois: Optional[List[Optional[RegionOfInterest]]] = None) -> List[np.ndarray]:
+        """
+        Returns one (N, 6) array of [x1, y1, x2, y2, conf, cls] detections per frame, in full-frame coordinates.
+        Frames with a region of interest are cropped to it first, and the batch is run at the smallest
+        input size that fits every crop (never above `imgsz`), so small regions cost less to infer.
+        """
+        if not frames:
+            return []
+        crops, offsets = [], []
+        for frame, roi in zip(frames, rois or [None] * len(frames)):
+            box = roi.crop_box(frame.shape) if roi else None
+            if box is None:
+                crops.append(frame)
+                offsets.append((0, 0))
+            else:
+                x0, y0, x1, y1 = box
+                crops.append(frame[y0:y1, x0:x1])
+                offsets.append((x0, y0))
+
+        longest_side = max(max(crop.shape[:2]) for crop in crops)
+        imgsz = min(self.imgsz, math.ceil(longest_side / 32) * 32)
+        results = self.model.predict(crops, classes=0, conf=self.conf, imgsz=imgsz, device=self.device, verbose=False)
+
+        detections = []
+        for result, (x0, y0) in zip(results, offsets):
+            data = result.boxes.data.cpu().numpy()
+            if x0 or y0:
+                data[:, [0, 2]] += x0
+                data[:, [1, 3]] += y0
+            detections.append(data)
+        return detections
+
+class StreamTracker:
+    """Holds the ByteTrack state of a single stream."""
+    def __init__(self, tracker_config: str = config.TRACKER_CONFIG, frame_rate: float = 30):
+        import yaml
+        from ultralytics.engine.results import Boxes
+        from ultralytics.trackers.track import TRACKER_MAP
+        from ultralytics.utils import IterableSimpleNamespace
+        from ultralytics.utils.checks import check_yaml
+
+        with open(check_yaml(tracker_config)) as f:
+            args = IterableSimpleNamespace(**yaml.safe_load(f))
+        self._tracker = TRACKER_MAP[args.tracker_type](args=args, frame_rate=int(frame_rate) or 30)
+        self._boxes_cls = Boxes
+
+    def update(self, detections: np.ndarray, frame: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Feeds one frame's detections to the tracker and returns the (boxes, track_ids) of active tracks."""
+        tracks = self._tracker.update(self._boxes_cls(detections, frame.shape[:2]), frame)
+        if len(tracks) == 0:
+            return np.empty((0, 4), dtype=int), np.empty((0,), dtype=int)
+        return tracks[:, :4].astype(int), tracks[:, 4].astype(int)
+
+class BatchScheduler:
+    """
+    Collects the latest frame from several streams and sends them through one Detector as a batch,
+    keeping tracker state separately for each stream.
+
+    A batch is dispatched as soon as `batch_size` streams have a frame ready, or `max_wait` seconds
+    after the first frame of the batch arrived, whichever comes first.
+
+    With a `stride_policy` (a factory such as AdaptiveStride), each stream only sends every k-th
+    frame to the detector and the track positions on the frames in between are predicted.
+    """
+    def __init__(
+        self,
+        detector: Detector,
+        batch_size: int = config.INFERENCE_BATCH_SIZE,
+        max_wait: float = config.INFERENCE_MAX_WAIT,
+        stride_policy: Optional[Callable[[], object]] = AdaptiveStride if config.ADAPTIVE_STRIDE else None,
+    ):
+        self.detector = detector
+        self.batch_size = max(1, batch_size)
+        self.max_wait = max_wait
+        self.stride_policy = stride_policy
+        self.grabbers: Dict[Hashable, FrameGrabber] = {}
+        self.strides: Dict[Hashable, object] = {}
+        self._trackers: Dict[Hashable, StreamTracker] = {}
+        self._propagators: Dict[Hashable, TrackPropagator] = {}
+        self._last_detected: Dict[Hashable, int] = {}
+        self._rois: Dict[Hashable, Optional[RegionOfInterest]] = {}
+        self._labels: Dict[Hashable, str] = {}  # Metric label of each stream
+        self._ready = threading.Event()
+        self._cursor = 0  # Rotates which stream is polled first, so no stream starves
+
+    def add_stream(self, key: Hashable, grabber: FrameGrabber, roi: Optional[RegionOfInterest] = None):
+        """Adds a stream. With a `roi`, detection only runs on that region of its frames."""
+        grabber.on_frame = self._ready.set
+        self.grabbers[key] = grabber
+        self._rois[key] = roi
+        self._labels[key] = metrics.source_label(grabber.source)
+        self._trackers[key] = StreamTracker(frame_rate=grabber.fps or 30)
+        if self.stride_policy:
+            self.strides[key] = self.stride_policy()
+            self._propagators[key] = TrackPropagator()
+        self._last_detected.pop(key, None)
+        self._ready.set()
+
+    def remove_stream(self, key: Hashable) -> Optional[FrameGrabber]:
+        self._trackers.pop(key, None)
+        self.strides.pop(key, None)
+        self._propagators.pop(key, None)
+        self._rois.pop(key, None)
+        self._labels.pop(key, None)
+        grabber = self.grabbers.pop(key, None)
+        if grabber:
+            grabber.on_frame = None
+        return grabber
+
+    def collect(self, timeout: float = 1.0) -> List[Tuple[Hashable, CapturedFrame]]:
+        """
+        Waits for frames and returns at most one per stream and at most `batch_size` in total.
+        Returns an empty list if no frame arrived within `timeout` seconds.
+        """
+        batch: Dict[Hashable, CapturedFrame] = {}
+        give_up_at = time.monotonic() + timeout
+        dispatch_at = None
+        while True:
+            self._ready.clear()
+            keys = list(self.grabbers)
+            if keys:
+                self._cursor = (self._cursor + 1) % len(keys)
+                keys = keys[self._cursor:] + keys[:self._cursor]
+            for key in keys:
+                if len(batch) >= self.batch_size:
+                    break
+                if key not in batch:
+                    captured = self.grabbers[key].read_latest(timeout=0)
+                    if captured is not None:
+                        batch[key] = captured
+
+            pending = sum(1 for key, grabber in self.grabbers.items() if key not in batch and not grabber.ended)
+            if len(batch) >= self.batch_size or pending == 0:
+                break
+            now = time.monotonic()
+            if batch and dispatch_at is None:
+                dispatch_at = now + self.max_wait
+            deadline = dispatch_at if dispatch_at is not None else give_up_at
+            if now >= deadline:
+                break
+            self._ready.wait(deadline - now)
+        return list(batch.items())
+
+    def _should_detect(self, key: Hashable, captured: CapturedFrame) -> bool:
+        stride = self.strides.get(key)
+        last = self._last_detected.get(key)
+        return stride is None or last is None or captured.index - last >= stride.stride
+
+    def process(self, batch: List[Tuple[Hashable, CapturedFrame]]) -> List[TrackedFrame]:
+        """
+        Runs detection on the frames of the batch that are due for it, then updates each stream's
+        tracker with its own detections. The other frames get predicted track positions.
+        """
+        started = time.perf_counter()
+        due = [(key, captured) for key, captured in batch if self._should_detect(key, captured)]
+        detections = self.detector.detect([captured.frame for _, captured in due], [self._rois[key] for key, _ in due])
+        detected_at = time.perf_counter()
+        if due:
+            BATCH_SECONDS.observe(detected_at - started)
+            BATCH_SIZE.observe(len(due))
+
+        tracked = {}
+        for (key, captured), stream_detections in zip(due, detections):
+            track_started = time.perf_counter()
+            boxes, track_ids = self._trackers[key].update(stream_detections, captured.frame)
+            label = self._labels[key]
+            STAGE_SECONDS.labels(label, "detect").observe(detected_at - started)
+            STAGE_SECONDS.labels(label, "track").observe(time.perf_counter() - track_started)
+            FRAMES.labels(label, "detected").inc()
+            tracked[key] = TrackedFrame(key, captured, boxes, track_ids, True)
+            self._last_detected[key] = captured.index
+            if key in self._propagators:
+                self._propagators[key].observe(captured.index, boxes, track_ids)
+        detect_seconds = time.perf_counter() - started
+
+        for key, captured in batch:
+            if key in tracked:
+                if key in self.strides:
+                    self.strides[key].update(detect_seconds, self.grabbers[key].fps)
+                    STRIDE.labels(self._labels[key]).set(self.strides[key].stride)
+            else:
+                boxes, track_ids = self._propagators[key].predict(captured.index)
+                FRAMES.labels(self._labels[key], "propagated").inc()
+                tracked[key] = TrackedFrame(key, captured, boxes, track_ids, False)
+        return [tracked[key] for key, _ in batch]
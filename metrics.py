@@ -0,0 +1,316 @@
+"""
+Lightweight Prometheus-style metrics.
+
+Counters, gauges and histograms live in a process-wide registry and are rendered in the
+Prometheus text format. Recording a value is a dict lookup and a short lock, so metrics can
+be recorded on every frame. Keep a reference to `metric.labels(...)` for hot loops to skip
+the lookup as well.
+
+Stream processes of the worker can't be scraped directly; they send `REGISTRY.snapshot()`
+to the supervisor, which serves them all from one MetricsServer with `render_snapshots`.
+"""
+import bisect
+import contextlib
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def source_label(source: str) -> str:
+    """Stream label for a video source, without any credentials embedded in the URL."""
+    return re.sub(r"//[^/@]*@", "//", str(source))
+
+class _CounterChild:
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self._value += amount
+
+    def value(self) -> float:
+        return self._value
+
+class _GaugeChild(_CounterChild):
+    def __init__(self):
+        super().__init__()
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float):
+        self._value = value
+
+    def dec(self, amount: float = 1.0):
+        self.inc(-amount)
+
+    def set_function(self, function: Callable[[], float]):
+        """Reads the value from `function` whenever the metrics are collected."""
+        self._function = function
+
+    def value(self) -> float:
+        return float(self._function()) if self._function else self._value
+
+class _HistogramChild:
+    def __init__(self, buckets: Sequence[float]):
+        self._buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)  # The last slot is +Inf
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        i = bisect.bisect_left(self._buckets, value)
+        with self._lock:
+            self._counts[i] += 1
+            self._sum += value
+
+    @contextlib.contextmanager
+    def time(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def value(self) -> Tuple[List[int], float]:
+        with self._lock:
+            return list(self._counts), self._sum
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """Returns the time series for these label values, creating it on first use."""
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {key}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def remove(self, *values):
+        """Drops a time series, e.g. for a stream that was removed."""
+        with self._lock:
+            self._children.pop(tuple(str(v) for v in values), None)
+
+    def snapshot(self) -> dict:
+        return {
+            "type": self.type_name,
+            "help": self.help,
+            "labelnames": list(self.labelnames),
+            "samples": [[list(key), child.value()] for key, child in list(self._children.items())],
+        }
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self.labels().dec(amount)
+
+    def set_function(self, function: Callable[[], float]):
+        self.labels().set_function(function)
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def time(self):
+        return self.labels().time()
+
+    def snapshot(self) -> dict:
+        snapshot = super().snapshot()
+        snapshot["buckets"] = list(self.buckets)
+        return snapshot
+
+class Registry:
+    """The metrics of one process. Creating a metric that already exists returns the existing one."""
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name: str, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} is already registered as a {metric.type_name}.")
+            return metric
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter, name, help_text, labelnames)
+
+    def gauge(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge, name, help_text, labelnames)
+
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, help_text, labelnames, buckets)
+
+    def snapshot(self) -> Dict[str, dict]:
+        """Current values of every metric as plain, picklable data."""
+        return {name: metric.snapshot() for name, metric in list(self._metrics.items())}
+
+    def render(self) -> str:
+        return render_snapshots([self.snapshot()])
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in zip(names, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def render_snapshots(snapshots: Iterable[Dict[str, dict]]) -> str:
+    """
+    Renders registry snapshots, e.g. of several processes, in the Prometheus text format.
+    Samples with the same name and labels in several snapshots are added up.
+    """
+    families: Dict[str, dict] = {}
+    for snapshot in snapshots:
+        for name, family in snapshot.items():
+            merged = families.setdefault(name, {**family, "samples": {}})
+            for labels, value in family["samples"]:
+                key = tuple(labels)
+                previous = merged["samples"].get(key)
+                if previous is None:
+                    merged["samples"][key] = value
+                elif family["type"] == "histogram":
+                    merged["samples"][key] = ([a + b for a, b in zip(previous[0], value[0])], previous[1] + value[1])
+                else:
+                    merged["samples"][key] = previous + value
+
+    lines = []
+    for name in sorted(families):
+        family = families[name]
+        labelnames = family["labelnames"]
+        lines.append(f"# HELP {name} {family['help']}")
+        lines.append(f"# TYPE {name} {family['type']}")
+        for labels, value in sorted(family["samples"].items()):
+            if family["type"] != "histogram":
+                lines.append(f"{name}{_format_labels(labelnames, labels)} {_format_value(value)}")
+                continue
+            counts, total = value
+            cumulative = 0
+            for bound, count in zip(list(family["buckets"]) + [float("inf")], counts):
+                cumulative += count
+                le = 'le="{}"'.format(_format_value(bound))
+                lines.append(f"{name}_bucket{_format_labels(labelnames, labels, le)} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labelnames, labels)} {_format_value(total)}")
+            lines.append(f"{name}_count{_format_labels(labelnames, labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+
+def instrument_engine(engine, registry: Registry = REGISTRY):
+    """Records the duration of every statement run through a SQLAlchemy engine, by SQL operation."""
+    from sqlalchemy import event
+
+    query_seconds = registry.histogram(
+        "people_counter_db_query_seconds", "Duration of database statements.", ["operation"],
+    )
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+        if operation not in ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH"):
+            operation = "OTHER"
+        query_seconds.labels(operation).observe(time.perf_counter() - started)
+
+    @event.listens_for(engine, "handle_error")
+    def _failed(context):
+        # after_cursor_execute doesn't run for failed statements
+        if context.connection is not None and context.connection.info.get("query_started"):
+            context.connection.info["query_started"].pop()
+
+class MetricsServer:
+    """Serves `/metrics` from a background thread, rendering whatever `render()` returns."""
+    def __init__(self, port: int, render: Callable[[], str] = REGISTRY.render, host: str = "0.0.0.0"):
+        server = self
+        self.render = render
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = server.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._server = ThreadingHTTPServer((host, port), MetricsHandler)
+        self._server.daemon_threads = True
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def start(self) -> "MetricsServer":
+        threading.Thread(target=self._server.serve_forever, name="metrics-server", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
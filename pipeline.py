@@ -0,0 +1,69 @@
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+
+from zones import ZoneEngine, ZoneEvent
+
+def load_model(model_path: str, backend: str = "torch", int8: bool = False):
+    """
+    Loads the YOLO model from the specified path. Imported lazily so supervisors don't load torch.
+    For the onnxruntime and openvino backends the cached export of the weights is loaded instead,
+    exporting it first if needed (see backends.py).
+    """
+    from ultralytics import YOLO
+    if backend != "torch":
+        from backends import prepare_model
+        model_path = prepare_model(model_path, backend, int8)
+    return YOLO(model_path, task="detect")
+
+def clean_polygon(raw_coords) -> Optional[np.ndarray]:
+    """
+    Converts the raw coordinates stored for an area into an int32 polygon.
+    Returns None if fewer than 3 valid points remain.
+    """
+    clean_coords = [c for c in raw_coords or [] if isinstance(c, (list, tuple)) and len(c) == 2]
+    if len(clean_coords) < 3:
+        return None
+    return np.array(clean_coords, np.int32)
+
+def extract_tracks(result) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns the (boxes, track_ids) of all tracked boxes in a single YOLO result."""
+    if result.boxes.id is None:
+        return np.empty((0, 4), dtype=int), np.empty((0,), dtype=int)
+    boxes = result.boxes.xyxy.cpu().numpy().astype(int)
+    track_ids = result.boxes.id.cpu().numpy().astype(int)
+    return boxes, track_ids
+
+def anchor_points(boxes: np.ndarray) -> np.ndarray:
+    """Returns the bottom-center point of each xyxy box as an (N, 2) int array."""
+    boxes = np.asarray(boxes, dtype=int).reshape(-1, 4)
+    return np.stack([(boxes[:, 0] + boxes[:, 2]) // 2, boxes[:, 3]], axis=1)
+
+def box_iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """IoU matrix of two sets of xyxy boxes."""
+    top_left = np.maximum(a[:, None, :2], b[None, :, :2])
+    bottom_right = np.minimum(a[:, None, 2:4], b[None, :, 2:4])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area_a = np.prod(a[:, 2:4] - a[:, :2], axis=1)
+    area_b = np.prod(b[:, 2:4] - b[:, :2], axis=1)
+    return intersection / np.maximum(area_a[:, None] + area_b[None, :] - intersection, 1e-9)
+
+class StreamCounter:
+    """
+    Counts entries and exits of tracked people for every area assigned to one video stream.
+    A person is located by the bottom-center point of their bounding box.
+    """
+    def __init__(self, polygons: Dict[int, np.ndarray]):
+        self.polygons = polygons
+        self.zones = ZoneEngine(polygons)
+        self.entry_counts = {area_id: 0 for area_id in polygons}
+        self.exit_counts = {area_id: 0 for area_id in polygons}
+
+    def update(self, boxes: np.ndarray, track_ids: np.ndarray) -> List[ZoneEvent]:
+        """Compares each tracked person's position with the previous frame and returns the new events."""
+        events = self.zones.update(track_ids, anchor_points(boxes))
+        for event in events:
+            if event.event_type == 'entry':
+                self.entry_counts[event.area_id] += 1
+            else:
+                self.exit_counts[event.area_id] += 1
+        return events
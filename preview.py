@@ -0,0 +1,221 @@
+"""
+Rate-limited live preview of the counting pipeline.
+
+The counting loop only hands its latest frame and tracks to a PreviewStream, and only while
+someone is watching. Annotating, resizing and JPEG encoding happen in the PreviewServer's
+request threads, at most PREVIEW_FPS times per second per stream, and the result is shared
+by every viewer of that stream. With nobody watching, the preview costs nothing.
+
+Endpoints, where KEY is the stream's key:
+    /streams/KEY.mjpg   multipart MJPEG stream
+    /streams/KEY.jpg    a single snapshot
+"""
+import contextlib
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+
+import config
+
+logger = logging.getLogger("preview")
+
+BOUNDARY = "frame"
+
+def render_preview(
+    frame: np.ndarray,
+    polygons: Dict[int, np.ndarray],
+    boxes: np.ndarray,
+    track_ids: np.ndarray,
+    entry_counts: Dict[int, int],
+    exit_counts: Dict[int, int],
+    width: int = config.PREVIEW_WIDTH,
+    quality: int = config.PREVIEW_JPEG_QUALITY,
+) -> bytes:
+    """Downscales the frame to at most `width` pixels, draws the areas, tracks and counts, and returns it as JPEG."""
+    scale = min(1.0, width / frame.shape[1])
+    if scale < 1.0:
+        image = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    else:
+        image = frame.copy()
+
+    for polygon in polygons.values():
+        cv2.polylines(image, [(polygon * scale).astype(np.int32)], isClosed=True, color=(0, 0, 255), thickness=2)
+    for (x1, y1, x2, y2), track_id in zip((np.asarray(boxes).reshape(-1, 4) * scale).astype(int), track_ids):
+        cv2.rectangle(image, (x1, y1), (x2, y2), (0, 255, 255), 2)
+        cv2.putText(image, str(track_id), (x1, max(y1 - 5, 12)), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 1, cv2.LINE_AA)
+
+    y = 30
+    for area_id in polygons:
+        label = f'Area {area_id}: ' if len(polygons) > 1 else ''
+        cv2.putText(image, f'{label}Entries: {entry_counts.get(area_id, 0)}', (20, y), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2, cv2.LINE_AA)
+        cv2.putText(image, f'{label}Exits: {exit_counts.get(area_id, 0)}', (20, y + 30), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 0, 0), 2, cv2.LINE_AA)
+        y += 70
+
+    ok, jpeg = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise RuntimeError("Could not encode the preview frame.")
+    return jpeg.tobytes()
+
+class PreviewStream:
+    """
+    Holds only the latest frame of one stream, plus its tracks and counts, for the preview.
+    `publish` is called by the counting loop for every frame and returns immediately when
+    nobody is watching. The frame is stored by reference, so it must not be modified afterwards.
+    """
+    def __init__(
+        self,
+        polygons: Dict[int, np.ndarray],
+        fps: float = config.PREVIEW_FPS,
+        width: int = config.PREVIEW_WIDTH,
+        quality: int = config.PREVIEW_JPEG_QUALITY,
+    ):
+        self.polygons = polygons
+        self.interval = 1.0 / max(fps, 0.1)
+        self.width = width
+        self.quality = quality
+        self.watchers = 0
+        self._cond = threading.Condition()
+        self._seq = 0
+        self._latest = None
+        self._render_lock = threading.Lock()
+        self._jpeg: Optional[bytes] = None
+        self._jpeg_seq = 0
+
+    @property
+    def watched(self) -> bool:
+        return self.watchers > 0
+
+    @property
+    def seq(self) -> int:
+        return self._seq
+
+    @contextlib.contextmanager
+    def watch(self):
+        """Marks a viewer as watching for the duration of the block."""
+        with self._cond:
+            self.watchers += 1
+        try:
+            yield self
+        finally:
+            with self._cond:
+                self.watchers -= 1
+                if not self.watchers:
+                    self._latest = None  # Don't keep a frame alive nobody looks at
+
+    def publish(self, frame: np.ndarray, boxes: np.ndarray, track_ids: np.ndarray, entry_counts: Dict[int, int], exit_counts: Dict[int, int]):
+        if not self.watchers:
+            return
+        with self._cond:
+            self._seq += 1
+            self._latest = (frame, boxes, track_ids, dict(entry_counts), dict(exit_counts))
+            self._cond.notify_all()
+
+    def wait(self, after_seq: int, timeout: float) -> bool:
+        """Waits until a frame newer than `after_seq` was published. Returns False on timeout."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._seq > after_seq, timeout)
+
+    def jpeg(self) -> Tuple[int, Optional[bytes]]:
+        """Returns (seq, jpeg) of the latest frame, encoding it only once however many viewers ask."""
+        with self._cond:
+            seq, latest = self._seq, self._latest
+        if latest is None:
+            return seq, None
+        with self._render_lock:
+            if self._jpeg_seq != seq:
+                self._jpeg = render_preview(latest[0], self.polygons, *latest[1:], width=self.width, quality=self.quality)
+                self._jpeg_seq = seq
+            return self._jpeg_seq, self._jpeg
+
+class PreviewServer:
+    """Small threaded HTTP server for the preview streams of one process, running in a background thread."""
+    def __init__(self, host: str = config.PREVIEW_HOST, port: int = config.PREVIEW_PORT):
+        self.streams: Dict[str, PreviewStream] = {}
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def add_stream(self, key, stream: PreviewStream):
+        self.streams[str(key)] = stream
+
+    def remove_stream(self, key):
+        self.streams.pop(str(key), None)
+
+    def start(self) -> "PreviewServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="preview-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _handler_class(self):
+        server = self
+
+        class PreviewHandler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                logger.debug(format, *args)
+
+            def do_GET(self):
+                name, _, extension = self.path.split("?")[0].removeprefix("/streams/").rpartition(".")
+                stream = server.streams.get(name)
+                if not self.path.startswith("/streams/") or stream is None or extension not in ("jpg", "mjpg"):
+                    self.send_error(404, "Unknown preview stream")
+                    return
+                try:
+                    if extension == "jpg":
+                        self._send_snapshot(stream)
+                    else:
+                        self._send_mjpeg(name, stream)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # The viewer went away
+
+            def _send_snapshot(self, stream: PreviewStream):
+                with stream.watch():
+                    # Frames are only published while watched, so wait for the next one
+                    stream.wait(stream.seq, timeout=2.0)
+                    _, jpeg = stream.jpeg()
+                if jpeg is None:
+                    self.send_error(503, "No frame available yet")
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "image/jpeg")
+                self.send_header("Content-Length", str(len(jpeg)))
+                self.send_header("Cache-Control", "no-store")
+                self.end_headers()
+                self.wfile.write(jpeg)
+
+            def _send_mjpeg(self, name: str, stream: PreviewStream):
+                self.send_response(200)
+                self.send_header("Content-Type", f"multipart/x-mixed-replace; boundary={BOUNDARY}")
+                self.send_header("Cache-Control", "no-store")
+                self.end_headers()
+                with stream.watch():
+                    seq = 0
+                    next_at = time.monotonic()
+                    while server.streams.get(name) is stream:
+                        if not stream.wait(seq, timeout=1.0):
+                            continue
+                        seq, jpeg = stream.jpeg()
+                        if jpeg is None:
+                            continue
+                        self.wfile.write(
+                            f"--{BOUNDARY}\r\nContent-Type: image/jpeg\r\nContent-Length: {len(jpeg)}\r\n\r\n".encode()
+                            + jpeg + b"\r\n"
+                        )
+                        self.wfile.flush()
+                        # Rate limit: skip straight to whatever frame is latest at the next slot
+                        next_at = max(next_at + stream.interval, time.monotonic())
+                        time.sleep(max(0.0, next_at - time.monotonic()))
+
+        return PreviewHandler
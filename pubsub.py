@@ -0,0 +1,131 @@
+import asyncio
+import collections
+import contextlib
+import threading
+from typing import AsyncIterator, Callable, Dict, Iterable, List, Optional, Set
+
+import config
+
+class Subscription:
+    """A live subscriber's bounded message queue and area filter (None means all areas)."""
+    def __init__(self, area_ids: Optional[Set[int]], queue_size: int):
+        self.area_ids = area_ids
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+
+    def wants(self, area_id: int) -> bool:
+        return self.area_ids is None or area_id in self.area_ids
+
+    async def get(self) -> dict:
+        return await self.queue.get()
+
+class EventBroker:
+    """
+    In-memory publish/subscribe fan-out of ingested events to live subscribers.
+
+    Publishing is thread-safe and never blocks: messages are handed to the event loop, and a
+    subscriber that can't keep up loses its oldest messages instead of slowing down ingestion.
+    While anyone is subscribed, the broker also keeps running entry/exit totals per area, so
+    every event can be followed by the area's updated counters without querying the database.
+    Subscribers and totals live in this process only, so run the API as a single process.
+    """
+    def __init__(self, queue_size: int = config.LIVE_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._subscriptions: List[Subscription] = []
+        self._counters: Dict[int, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+        self._area_locks: Dict[int, asyncio.Lock] = collections.defaultdict(asyncio.Lock)
+
+    def attach_loop(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+
+    @property
+    def has_subscribers(self) -> bool:
+        return bool(self._subscriptions)
+
+    @property
+    def subscriber_count(self) -> int:
+        return len(self._subscriptions)
+
+    def subscribe(self, area_ids: Optional[Iterable[int]] = None) -> Subscription:
+        subscription = Subscription(set(area_ids) if area_ids else None, self.queue_size)
+        with self._lock:
+            self._subscriptions = self._subscriptions + [subscription]
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            self._subscriptions = [s for s in self._subscriptions if s is not subscription]
+            if not self._subscriptions:
+                # Totals aren't maintained without subscribers, so they'd go stale
+                self._counters.clear()
+
+    def forget_area(self, area_id: int):
+        with self._lock:
+            self._counters.pop(area_id, None)
+
+    @contextlib.asynccontextmanager
+    async def publishing(self, area_ids: Iterable[int]) -> AsyncIterator[None]:
+        """
+        Serializes ingest-then-publish per area. Hold it from writing new events until they are
+        published: totals loaded for an area then never include events that will still be added
+        to them, which would count those events twice.
+        """
+        async with contextlib.AsyncExitStack() as stack:
+            for area_id in sorted(set(area_ids)):  # Always in the same order, so batches can't deadlock
+                await stack.enter_async_context(self._area_locks[area_id])
+            yield
+
+    def areas_to_load(self, area_ids: Iterable[int]) -> Set[int]:
+        """The areas `publish_events` would call `load_counts` for, so async callers can load them beforehand."""
+        if not self._subscriptions:
+            return set()
+        return {area_id for area_id in area_ids if area_id not in self._counters}
+
+    def publish_events(self, events: List[dict], load_counts: Callable[[int], Optional[Dict[str, int]]]):
+        """
+        Publishes committed events (dicts with area_id, event_type, tracker_id and timestamp),
+        each followed by the updated counters of its area. `load_counts(area_id)` returns an area's
+        lifetime totals from the database, including these events; it is only called the first time
+        an area is seen while someone is subscribed. If it returns None, the area's events are published
+        without counters, and its totals are loaded the next time instead of starting from zero.
+        """
+        if not self._subscriptions or self._loop is None:
+            return
+        messages = []
+        with self._lock:
+            newly_loaded, unknown = set(), set()
+            for event in events:
+                area_id = event["area_id"]
+                if area_id not in self._counters and area_id not in unknown:
+                    counts = load_counts(area_id)
+                    if counts is None:
+                        unknown.add(area_id)
+                    else:
+                        self._counters[area_id] = {"entry": counts.get("entry", 0), "exit": counts.get("exit", 0)}
+                        newly_loaded.add(area_id)
+                if area_id not in newly_loaded and area_id not in unknown:
+                    self._counters[area_id][event["event_type"]] += 1
+                messages.append({
+                    "type": "event",
+                    "area_id": area_id,
+                    "event_type": event["event_type"],
+                    "tracker_id": event.get("tracker_id"),
+                    "timestamp": event["timestamp"].isoformat(),
+                })
+            for area_id in {event["area_id"] for event in events} - unknown:
+                counters = self._counters[area_id]
+                messages.append({"type": "counters", "area_id": area_id, "entries": counters["entry"], "exits": counters["exit"]})
+        self._loop.call_soon_threadsafe(self._deliver, messages)
+
+    def _deliver(self, messages: List[dict]):
+        """Runs on the event loop and fans messages out to the matching subscribers."""
+        for subscription in self._subscriptions:
+            for message in messages:
+                if not subscription.wants(message["area_id"]):
+                    continue
+                if subscription.queue.full():
+                    subscription.queue.get_nowait()
+                    subscription.dropped += 1
+                subscription.queue.put_nowait(message)
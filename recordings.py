@@ -0,0 +1,313 @@
+"""
+Faster-than-real-time counting of recorded video files.
+
+The file is cut into segments of RECORDING_SEGMENT_SECONDS that are detected and tracked in
+parallel by a pool of processes, each with its own detector. Every segment starts tracking
+RECORDING_OVERLAP_SECONDS before its first counted frame, so its tracker is warmed up by then
+and the frames of that lead-in were also tracked by the previous segment. Tracks are stitched
+across the boundary by how well their boxes agree over those shared frames: a track that
+continues one from the previous segment keeps its id.
+
+The main process then replays the stitched tracks frame by frame through a single
+StreamCounter, so the inside/outside state of every person carries across segment
+boundaries exactly as it would in one long run. Nobody is counted twice or missed at a cut.
+Events are stamped with the recording's start time plus their position in the video.
+
+Usage:
+    python recordings.py recording.mp4 1,2 --start-time 2024-05-01T08:00:00+07:00
+    python recordings.py recording.mp4 3 --workers 16 --dry-run
+"""
+import argparse
+import collections
+import concurrent.futures
+import datetime
+import itertools
+import logging
+import math
+import multiprocessing as mp
+import os
+import time
+import uuid
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import cv2
+import numpy as np
+
+import config
+from event_buffer import EventBuffer
+from inference import Detector, StreamTracker
+from pipeline import StreamCounter, box_iou
+from roi import RegionOfInterest
+from worker import configure_logging, fetch_area_polygons, parse_area_ids
+
+logger = logging.getLogger("recordings")
+
+class Segment(NamedTuple):
+    """A part of the video tracked by one process. Frames lead_in..start-1 are only there to warm up the tracker."""
+    index: int
+    lead_in: int
+    start: int
+    end: Optional[int]  # Exclusive; None reads to the end of the file
+
+class SegmentTracks(NamedTuple):
+    """The tracked boxes of every frame of a segment, from its lead-in on, with the segment's own track ids."""
+    segment: Segment
+    boxes: List[np.ndarray]
+    track_ids: List[np.ndarray]
+
+    @property
+    def end(self) -> int:
+        """One past the last frame that was actually read, which may be short of `segment.end` if the file is."""
+        return self.segment.lead_in + len(self.boxes)
+
+    def at(self, frame_index: int) -> Tuple[np.ndarray, np.ndarray]:
+        i = frame_index - self.segment.lead_in
+        if 0 <= i < len(self.boxes):
+            return self.boxes[i], self.track_ids[i]
+        return np.empty((0, 4), dtype=int), np.empty((0,), dtype=int)
+
+def video_info(path: str) -> Tuple[int, float]:
+    """Returns the (frame count, fps) a video file reports. The count is 0 if the container doesn't know it."""
+    cap = cv2.VideoCapture(path)
+    try:
+        if not cap.isOpened():
+            raise RuntimeError(f"Could not open video file '{path}'.")
+        return max(int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), 0), cap.get(cv2.CAP_PROP_FPS) or 30.0
+    finally:
+        cap.release()
+
+def plan_segments(total_frames: int, fps: float, segment_seconds: float, overlap_seconds: float) -> List[Segment]:
+    """Splits a video into segments with a lead-in. The last one reads to the end, in case the frame count was short."""
+    length = max(1, int(segment_seconds * fps))
+    overlap = min(max(0, int(overlap_seconds * fps)), length)
+    count = max(1, math.ceil(total_frames / length))
+    return [
+        Segment(i, max(0, i * length - overlap), i * length, (i + 1) * length if i < count - 1 else None)
+        for i in range(count)
+    ]
+
+# --- Segment processes ---
+_detector = None
+_tracker_factory: Callable = StreamTracker
+
+def _init_process(detector_factory: Callable, tracker_factory: Callable, threads: int):
+    """Loads one detector per process. Capping the threads keeps the processes from fighting over cores."""
+    global _detector, _tracker_factory
+    if threads:
+        cv2.setNumThreads(threads)
+        try:
+            import torch
+            torch.set_num_threads(threads)
+        except ImportError:
+            pass
+    _detector = detector_factory()
+    _tracker_factory = tracker_factory
+
+def track_segment(
+    path: str,
+    segment: Segment,
+    fps: float,
+    polygons: Optional[Dict[int, np.ndarray]] = None,
+    batch_size: int = config.INFERENCE_BATCH_SIZE,
+) -> SegmentTracks:
+    """
+    Detects and tracks one segment with a fresh tracker, starting at its lead-in. With `polygons`,
+    detection only runs on the region of interest around them.
+    """
+    cap = cv2.VideoCapture(path)
+    if segment.lead_in:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, segment.lead_in)
+    tracker = _tracker_factory(frame_rate=fps)
+    roi = RegionOfInterest(polygons) if polygons else None
+    boxes, track_ids = [], []
+    frame_index = segment.lead_in
+    try:
+        ended = False
+        while not ended:
+            frames = []
+            while len(frames) < batch_size and (segment.end is None or frame_index < segment.end):
+                ok, frame = cap.read()
+                if not ok:
+                    break
+                frames.append(frame)
+                frame_index += 1
+            ended = len(frames) < batch_size
+            # Detection is stateless, so frames are batched; tracking has to go in order
+            for frame, detections in zip(frames, _detector.detect(frames, [roi] * len(frames))):
+                frame_boxes, frame_ids = tracker.update(detections, frame)
+                boxes.append(frame_boxes)
+                track_ids.append(frame_ids)
+    finally:
+        cap.release()
+    return SegmentTracks(segment, boxes, track_ids)
+
+# --- Stitching and replay ---
+def stitch(previous: SegmentTracks, current: SegmentTracks, min_score: float = config.RECORDING_STITCH_IOU) -> Dict[int, int]:
+    """
+    Pairs the tracks of `current` with the tracks of `previous` that follow the same person through
+    the lead-in frames both segments tracked, returning {current id: previous id}.
+
+    A pair scores the sum of its box IoU over those frames, divided by the number of frames in
+    which either track appears, so a brief overlap of two passers-by scores low. Pairs are
+    matched greedily from the best score down, each track at most once.
+    """
+    iou_sums: Dict[Tuple[int, int], float] = collections.defaultdict(float)
+    together: Dict[Tuple[int, int], int] = collections.Counter()
+    present_previous: Dict[int, int] = collections.Counter()
+    present_current: Dict[int, int] = collections.Counter()
+    for frame_index in range(current.segment.lead_in, current.segment.start):
+        previous_boxes, previous_ids = previous.at(frame_index)
+        current_boxes, current_ids = current.at(frame_index)
+        present_previous.update(previous_ids.tolist())
+        present_current.update(current_ids.tolist())
+        if not len(previous_ids) or not len(current_ids):
+            continue
+        iou = box_iou(current_boxes, previous_boxes)
+        for i, j in zip(*np.nonzero(iou)):
+            pair = (int(current_ids[i]), int(previous_ids[j]))
+            iou_sums[pair] += iou[i, j]
+            together[pair] += 1
+
+    scores = sorted(
+        ((total / (present_current[c] + present_previous[p] - together[(c, p)]), c, p) for (c, p), total in iou_sums.items()),
+        reverse=True,
+    )
+    matches: Dict[int, int] = {}
+    taken = set()
+    for score, current_id, previous_id in scores:
+        if score < min_score:
+            break
+        if current_id in matches or previous_id in taken:
+            continue
+        matches[current_id] = previous_id
+        taken.add(previous_id)
+    return matches
+
+class _TrackIds:
+    """Maps a segment's own track ids to ids that are unique across the whole recording."""
+    def __init__(self, next_id: Iterator[int], inherited: Optional[Dict[int, int]] = None):
+        self._next_id = next_id
+        self.ids: Dict[int, int] = dict(inherited or {})
+
+    def map(self, track_ids: np.ndarray) -> np.ndarray:
+        for track_id in track_ids.tolist():
+            if track_id not in self.ids:
+                self.ids[track_id] = next(self._next_id)
+        return np.array([self.ids[track_id] for track_id in track_ids.tolist()], dtype=int)
+
+def count_recording(
+    path: str,
+    polygons: Dict[int, np.ndarray],
+    start_time: datetime.datetime,
+    events: Optional[EventBuffer] = None,
+    workers: int = config.RECORDING_WORKERS,
+    threads_per_worker: int = config.RECORDING_THREADS_PER_WORKER,
+    segment_seconds: float = config.RECORDING_SEGMENT_SECONDS,
+    overlap_seconds: float = config.RECORDING_OVERLAP_SECONDS,
+    detector_factory: Callable = Detector,
+    tracker_factory: Callable = StreamTracker,
+    use_roi: bool = config.ROI_CROP,
+    progress: Optional[Callable[[float], None]] = None,
+) -> StreamCounter:
+    """
+    Counts a recorded video file in parallel and returns the StreamCounter with the totals.
+    Events go to `events` stamped with `start_time` plus their offset in the video.
+    `detector_factory` and `tracker_factory` are called in the worker processes, so they must be
+    picklable, e.g. a class or a functools.partial. `progress` is called with the fraction done.
+    """
+    total_frames, fps = video_info(path)
+    segments = plan_segments(total_frames, fps, segment_seconds, overlap_seconds)
+    threads = max(1, threads_per_worker)
+    workers = min(workers or max(1, (os.cpu_count() or 1) // threads), len(segments))
+    logger.info(
+        "Counting '%s' (%d frames at %.1f fps) in %d segments with %d processes...",
+        path, total_frames, fps, len(segments), workers,
+    )
+
+    counter = StreamCounter(polygons)
+    next_id = itertools.count(1)
+    previous: Optional[SegmentTracks] = None
+    previous_ids: Optional[_TrackIds] = None
+    # spawn avoids forking a process that may already hold OpenCV/torch threads
+    with concurrent.futures.ProcessPoolExecutor(
+        workers, mp_context=mp.get_context("spawn"),
+        initializer=_init_process, initargs=(detector_factory, tracker_factory, threads),
+    ) as pool:
+        futures = collections.deque(pool.submit(track_segment, path, segment, fps, polygons if use_roi else None) for segment in segments)
+        try:
+            while futures:
+                # Results are replayed in order; later segments keep tracking in the meantime. Popping the
+                # future drops its result once the next segment is stitched, so tracks don't pile up.
+                tracks = futures.popleft().result()
+                inherited = {}
+                if previous is not None:
+                    inherited = {c: previous_ids.ids[p] for c, p in stitch(previous, tracks).items() if p in previous_ids.ids}
+                track_ids = _TrackIds(next_id, inherited)
+                for frame_index in range(tracks.segment.start, tracks.end):
+                    boxes, local_ids = tracks.at(frame_index)
+                    for event in counter.update(boxes, track_ids.map(local_ids)):
+                        if events is not None:
+                            timestamp = start_time + datetime.timedelta(seconds=frame_index / fps)
+                            events.add(event.area_id, event.event_type, event.tracker_id, timestamp)
+                previous, previous_ids = tracks, track_ids
+                if progress is not None:
+                    progress((tracks.segment.index + 1) / len(segments))
+        except BaseException:
+            # Don't track the rest of the file after a failure or when interrupted
+            for future in futures:
+                future.cancel()
+            raise
+    return counter
+
+def default_start_time(path: str) -> datetime.datetime:
+    """When the recording started, assuming the file was last written when it ended."""
+    total_frames, fps = video_info(path)
+    ended = datetime.datetime.fromtimestamp(os.path.getmtime(path), datetime.timezone.utc)
+    return ended - datetime.timedelta(seconds=total_frames / fps)
+
+def main():
+    parser = argparse.ArgumentParser(description="Count people in a recorded video file, in parallel and faster than real time.")
+    parser.add_argument("path", help="The video file.")
+    parser.add_argument("area_ids", help="Comma-separated list of area ids.")
+    parser.add_argument(
+        "--start-time", type=datetime.datetime.fromisoformat,
+        help="When the recording started (ISO 8601). Defaults to the file's modification time minus its duration.",
+    )
+    parser.add_argument("--workers", type=int, default=config.RECORDING_WORKERS, help="Parallel processes. 0 uses every core.")
+    parser.add_argument("--threads-per-worker", type=int, default=config.RECORDING_THREADS_PER_WORKER)
+    parser.add_argument("--segment-seconds", type=float, default=config.RECORDING_SEGMENT_SECONDS)
+    parser.add_argument("--overlap-seconds", type=float, default=config.RECORDING_OVERLAP_SECONDS)
+    parser.add_argument("--dry-run", action="store_true", help="Only print the counts; don't send the events to the API.")
+    args = parser.parse_args()
+
+    configure_logging()
+    polygons = fetch_area_polygons(parse_area_ids(args.area_ids))
+    if not polygons:
+        parser.error("None of the areas could be loaded from the API.")
+    start_time = args.start_time or default_start_time(args.path)
+    if start_time.tzinfo is None:
+        start_time = start_time.astimezone()  # Local time, like the camera's clock
+
+    events = None if args.dry_run else EventBuffer(f"recordings-{uuid.uuid4().hex[:12]}")
+    started = time.monotonic()
+    try:
+        counter = count_recording(
+            args.path, polygons, start_time, events,
+            workers=args.workers,
+            threads_per_worker=args.threads_per_worker,
+            segment_seconds=args.segment_seconds,
+            overlap_seconds=args.overlap_seconds,
+            progress=lambda done: logger.info("%.0f%% done", done * 100),
+        )
+    finally:
+        if events is not None:
+            events.close(timeout=60)
+    elapsed = time.monotonic() - started
+
+    total_frames, fps = video_info(args.path)
+    logger.info("Counted %.0f s of video in %.0f s (%.1fx real time).", total_frames / fps, elapsed, total_frames / fps / max(elapsed, 1e-9))
+    for area_id in polygons:
+        print(f"Area {area_id}: {counter.entry_counts[area_id]} entries, {counter.exit_counts[area_id]} exits")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+import config
+
+class RegionOfInterest:
+    """
+    Padded crop around the union of a camera's polygon bounding boxes, so detection only
+    runs on the pixels that can affect the counts.
+
+    Anchor points are the feet of a person, so the crop reaches further above the polygons
+    (`top_padding`) than to the other sides (`padding`). Both are fractions of the frame height.
+    """
+    def __init__(
+        self,
+        polygons: Dict[int, np.ndarray],
+        padding: float = config.ROI_PADDING,
+        top_padding: float = config.ROI_TOP_PADDING,
+        min_size: int = config.ROI_MIN_SIZE,
+        max_area_ratio: float = 0.8,
+    ):
+        points = np.concatenate([np.asarray(p).reshape(-1, 2) for p in polygons.values()])
+        self._x0, self._y0 = points.min(axis=0)
+        self._x1, self._y1 = points.max(axis=0) + 1
+        self.padding = padding
+        self.top_padding = top_padding
+        self.min_size = min_size
+        self.max_area_ratio = max_area_ratio
+        self._boxes: Dict[Tuple[int, int], Optional[Tuple[int, int, int, int]]] = {}
+
+    def crop_box(self, frame_shape: Tuple[int, ...]) -> Optional[Tuple[int, int, int, int]]:
+        """
+        Returns the (x0, y0, x1, y1) crop for frames of `frame_shape`, or None if the crop
+        would cover most of the frame anyway.
+        """
+        height, width = frame_shape[:2]
+        key = (height, width)
+        if key not in self._boxes:
+            self._boxes[key] = self._compute(height, width)
+        return self._boxes[key]
+
+    def _compute(self, height: int, width: int) -> Optional[Tuple[int, int, int, int]]:
+        pad = int(self.padding * height)
+        x0, x1 = self._x0 - pad, self._x1 + pad
+        y0, y1 = self._y0 - int(self.top_padding * height), self._y1 + pad
+
+        # Grow tiny crops around their center so people near the polygons are still fully visible
+        if x1 - x0 < self.min_size:
+            grow = (self.min_size - (x1 - x0)) // 2
+            x0, x1 = x0 - grow, x1 + grow
+        if y1 - y0 < self.min_size:
+            grow = (self.min_size - (y1 - y0)) // 2
+            y0, y1 = y0 - grow, y1 + grow
+
+        x0, y0 = max(int(x0), 0), max(int(y0), 0)
+        x1, y1 = min(int(x1), width), min(int(y1), height)
+        if x1 <= x0 or y1 <= y0:
+            return None  # Polygons lie outside this frame; don't hide the whole image
+        if (x1 - x0) * (y1 - y0) > self.max_area_ratio * width * height:
+            return None
+        return x0, y0, x1, y1
@@ -0,0 +1,206 @@
+"""
+Time-bucketed rollups of counting events.
+
+`counting_rollups` holds the number of events per area, event type and bucket of
+config.ROLLUP_BUCKET_SECONDS. It is updated on every ingest, and statistics read whole
+buckets from it, touching raw events only for the partial buckets at the edges of a range.
+
+After changing ROLLUP_BUCKET_SECONDS, or if the table drifts from the raw events,
+rebuild it with:
+    python rollups.py rebuild
+"""
+import collections
+import datetime
+import sys
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import DateTime, Integer, and_, case, func, insert, literal_column, or_, select, text
+from sqlalchemy.orm import Session
+
+import config
+import database
+
+Event = database.CountingEvent
+Rollup = database.CountingRollup
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+def as_utc(ts: datetime.datetime) -> datetime.datetime:
+    """Returns `ts` as an aware UTC datetime. Naive datetimes are taken to be UTC already."""
+    if ts.tzinfo is None:
+        return ts.replace(tzinfo=datetime.timezone.utc)
+    return ts.astimezone(datetime.timezone.utc)
+
+def bucket_start(ts: datetime.datetime, seconds: int = config.ROLLUP_BUCKET_SECONDS) -> datetime.datetime:
+    """Returns the start of the bucket `ts` falls into."""
+    offset = (as_utc(ts) - EPOCH).total_seconds()
+    return EPOCH + datetime.timedelta(seconds=offset // seconds * seconds)
+
+def bucket_expression(column, seconds: int, dialect_name: str):
+    """SQL expression flooring a timestamp column to buckets of `seconds`, matching `bucket_start`."""
+    # Inlined rather than bound, so the same expression can appear in SELECT and GROUP BY
+    seconds = literal_column(str(int(seconds)))
+    if dialect_name == "sqlite":
+        epoch = func.cast(func.strftime('%s', column), Integer)
+        # Integer division, formatted the way SQLAlchemy stores DateTime values in SQLite
+        return func.strftime('%Y-%m-%d %H:%M:%S.000000', epoch.op('/')(seconds) * seconds, 'unixepoch', type_=DateTime(timezone=True))
+    return func.to_timestamp(func.floor(func.extract('epoch', column) / seconds) * seconds, type_=DateTime(timezone=True))
+
+def _upsert(db: Session):
+    """Returns the dialect's INSERT construct that supports ON CONFLICT."""
+    if db.get_bind().dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    return dialect_insert
+
+def add_to_rollups(db: Session, events: Iterable[dict]):
+    """
+    Adds ingested events (dicts with area_id, event_type and an aware timestamp) to their buckets.
+    Runs in the caller's transaction so the rollups commit together with the raw events.
+    """
+    counts = collections.Counter(
+        (event["area_id"], event["event_type"], bucket_start(event["timestamp"])) for event in events
+    )
+    if not counts:
+        return
+    rows = [
+        {"area_id": area_id, "event_type": event_type, "bucket_start": bucket, "count": count}
+        for (area_id, event_type, bucket), count in counts.items()
+    ]
+    stmt = _upsert(db)(Rollup)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Rollup.area_id, Rollup.event_type, Rollup.bucket_start],
+        set_={"count": Rollup.count + stmt.excluded["count"]},
+    )
+    db.execute(stmt, rows)
+
+def rebuild_rollups(db: Session, area_id: Optional[int] = None):
+    """Recomputes the rollups from the raw events, for one area or for all of them."""
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        # Scans every event, which can take far longer than DB_STATEMENT_TIMEOUT_MS allows a request
+        db.execute(text("SET LOCAL statement_timeout = 0"))
+    seconds = config.ROLLUP_BUCKET_SECONDS
+    bucket = bucket_expression(Event.timestamp, seconds, dialect)
+    delete = Rollup.__table__.delete()
+    source = select(Event.area_id, Event.event_type, bucket, func.count()).group_by(Event.area_id, Event.event_type, bucket)
+    if area_id is not None:
+        delete = delete.where(Rollup.area_id == area_id)
+        source = source.where(Event.area_id == area_id)
+    db.execute(delete)
+    db.execute(insert(Rollup).from_select(["area_id", "event_type", "bucket_start", "count"], source))
+    db.commit()
+
+def backfill_if_empty(db: Session):
+    """Builds the rollups for a database that has events but no rollups yet, e.g. right after upgrading."""
+    if db.query(Rollup.area_id).first() is None and db.query(Event.id).first() is not None:
+        print("Building counting rollups from existing events...")
+        rebuild_rollups(db)
+
+def count_events(
+    db: Session,
+    area_id: int,
+    start: Optional[datetime.datetime] = None,
+    end: Optional[datetime.datetime] = None,
+) -> Dict[str, int]:
+    """
+    Returns {'entry': n, 'exit': n} for events with start <= timestamp <= end.
+    Whole buckets inside the range come from the rollups; only the partial buckets
+    at the edges are counted from raw events.
+    """
+    seconds = config.ROLLUP_BUCKET_SECONDS
+    step = datetime.timedelta(seconds=seconds)
+    start = as_utc(start) if start else None
+    end = as_utc(end) if end else None
+
+    # Rollup buckets fully inside the range: first_full <= bucket_start < last_partial
+    first_full = None
+    if start is not None:
+        first_full = bucket_start(start, seconds)
+        if first_full < start:
+            first_full += step
+    last_partial = bucket_start(end, seconds) if end is not None else None
+
+    totals = {'entry': 0, 'exit': 0}
+    if first_full is not None and last_partial is not None and first_full >= last_partial:
+        # The range spans less than one whole bucket; count it raw
+        raw_ranges = [and_(Event.timestamp >= start, Event.timestamp <= end)]
+    else:
+        query = db.query(Rollup.event_type, func.sum(Rollup.count)).filter(Rollup.area_id == area_id)
+        if first_full is not None:
+            query = query.filter(Rollup.bucket_start >= first_full)
+        if last_partial is not None:
+            query = query.filter(Rollup.bucket_start < last_partial)
+        for event_type, count in query.group_by(Rollup.event_type):
+            totals[event_type] = totals.get(event_type, 0) + int(count or 0)
+
+        raw_ranges = []
+        if start is not None and start < first_full:
+            raw_ranges.append(and_(Event.timestamp >= start, Event.timestamp < first_full))
+        if end is not None:
+            raw_ranges.append(and_(Event.timestamp >= last_partial, Event.timestamp <= end))
+
+    if raw_ranges:
+        query = db.query(Event.event_type, func.count()) \
+            .filter(Event.area_id == area_id) \
+            .filter(or_(*raw_ranges)) \
+            .group_by(Event.event_type)
+        for event_type, count in query:
+            totals[event_type] = totals.get(event_type, 0) + count
+    return totals
+
+def count_by_bucket(
+    db: Session,
+    area_id: int,
+    seconds: int,
+    start: datetime.datetime,
+    end: datetime.datetime,
+) -> Dict[datetime.datetime, Tuple[int, int]]:
+    """
+    Returns {bucket_start: (entries, exits)} for buckets of `seconds` with events in start <= timestamp < end.
+    Buckets are aligned to the Unix epoch (UTC), and buckets without events are left out.
+
+    Runs a single aggregate query with conditional aggregation. It reads the rollups when the
+    range and bucket size line up with rollup buckets, and the raw events otherwise.
+    """
+    start, end = as_utc(start), as_utc(end)
+    rollup_seconds = config.ROLLUP_BUCKET_SECONDS
+    aligned = (
+        seconds % rollup_seconds == 0
+        and bucket_start(start, rollup_seconds) == start
+        and bucket_start(end, rollup_seconds) == end
+    )
+    if aligned:
+        area_column, type_column, ts_column, weight = Rollup.area_id, Rollup.event_type, Rollup.bucket_start, Rollup.count
+    else:
+        area_column, type_column, ts_column, weight = Event.area_id, Event.event_type, Event.timestamp, 1
+
+    bucket = bucket_expression(ts_column, seconds, db.get_bind().dialect.name)
+    entries = func.sum(case((type_column == 'entry', weight), else_=0))
+    exits = func.sum(case((type_column == 'exit', weight), else_=0))
+    rows = db.query(bucket, entries, exits) \
+        .filter(area_column == area_id, ts_column >= start, ts_column < end) \
+        .group_by(bucket) \
+        .order_by(bucket)
+    return {as_utc(bucket_value): (int(e or 0), int(x or 0)) for bucket_value, e, x in rows}
+
+def summarize_areas(db: Session) -> List[Tuple[int, str, int, int]]:
+    """Returns (area_id, name, entries, exits) for every area, including areas without events, in one query."""
+    entries = func.coalesce(func.sum(case((Rollup.event_type == 'entry', Rollup.count), else_=0)), 0)
+    exits = func.coalesce(func.sum(case((Rollup.event_type == 'exit', Rollup.count), else_=0)), 0)
+    rows = db.query(database.Area.id, database.Area.name, entries, exits) \
+        .outerjoin(Rollup, Rollup.area_id == database.Area.id) \
+        .group_by(database.Area.id, database.Area.name) \
+        .order_by(database.Area.id)
+    return [(area_id, name, int(e), int(x)) for area_id, name, e, x in rows]
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["rebuild"]:
+        sys.exit("Usage: python rollups.py rebuild")
+    database.create_db_and_tables()
+    db = database.SessionLocal()
+    try:
+        rebuild_rollups(db)
+        print("Counting rollups rebuilt successfully.")
+    finally:
+        db.close()
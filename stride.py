@@ -0,0 +1,89 @@
+"""
+Frame-stride inference: run the detector only every k-th frame of a stream and
+predict track positions on the frames in between.
+
+Use validate_stride.py to check the counts against running on every frame.
+"""
+from typing import Dict, Tuple
+
+import numpy as np
+
+import config
+
+class FixedStride:
+    """Runs the detector every `stride` frames."""
+    def __init__(self, stride: int = 1):
+        self.stride = max(1, stride)
+
+    def update(self, detect_seconds: float, fps: float):
+        pass
+
+class AdaptiveStride:
+    """
+    Picks the stride k so a stream keeps up with real time.
+
+    Each detection costs about c seconds of wall time (the whole batch it ran in), and the source
+    delivers `fps` frames per second, so the stream keeps up when k >= c * fps. The stride aims for
+    `target_load` of that budget, using an EWMA of c and moving one step at a time.
+    """
+    def __init__(
+        self,
+        max_stride: int = config.STRIDE_MAX,
+        target_load: float = config.STRIDE_TARGET_LOAD,
+        smoothing: float = 0.2,
+    ):
+        self.stride = 1
+        self.max_stride = max(1, max_stride)
+        self.target_load = target_load
+        self.smoothing = smoothing
+        self._cost = None
+
+    def update(self, detect_seconds: float, fps: float):
+        """Records the wall time of a detection on this stream and adjusts the stride."""
+        if self._cost is None:
+            self._cost = detect_seconds
+        else:
+            self._cost += self.smoothing * (detect_seconds - self._cost)
+        # Share of real time the detector needs at stride k
+        load = lambda k: self._cost * (fps or 30) / k
+        if load(self.stride) > self.target_load:
+            self.stride = min(self.stride + 1, self.max_stride)
+        elif self.stride > 1 and load(self.stride - 1) < self.target_load * 0.75:
+            # Only step down with some headroom, so the stride doesn't flip back and forth
+            self.stride -= 1
+
+class TrackPropagator:
+    """
+    Predicts the boxes of the tracks from the last detection on frames the detector skipped,
+    by extrapolating each track with its (smoothed) per-frame velocity.
+    """
+    def __init__(self, smoothing: float = 0.5):
+        self.smoothing = smoothing
+        self._frame_index = 0
+        self._ids = np.empty((0,), dtype=int)
+        self._boxes = np.empty((0, 4), dtype=np.float64)
+        self._velocity = np.empty((0, 4), dtype=np.float64)
+
+    def observe(self, frame_index: int, boxes: np.ndarray, track_ids: np.ndarray):
+        """Records the tracker output of a detected frame. Tracks missing from it are forgotten."""
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        velocity = np.zeros_like(boxes)
+        elapsed = frame_index - self._frame_index
+        if elapsed > 0 and len(self._ids):
+            previous: Dict[int, int] = {int(track_id): row for row, track_id in enumerate(self._ids)}
+            for row, track_id in enumerate(track_ids):
+                prev_row = previous.get(int(track_id))
+                if prev_row is None:
+                    continue
+                measured = (boxes[row] - self._boxes[prev_row]) / elapsed
+                velocity[row] = self._velocity[prev_row] + self.smoothing * (measured - self._velocity[prev_row])
+        self._frame_index = frame_index
+        self._ids = np.asarray(track_ids, dtype=int)
+        self._boxes = boxes
+        self._velocity = velocity
+
+    def predict(self, frame_index: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Returns the predicted (boxes, track_ids) for a skipped frame."""
+        elapsed = frame_index - self._frame_index
+        boxes = self._boxes + self._velocity * elapsed
+        return np.rint(boxes).astype(int), self._ids.copy()
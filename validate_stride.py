@@ -0,0 +1,99 @@
+"""
+Validation harness for frame-stride inference.
+
+Counts a video file twice, once running the detector on every frame and once with a
+frame stride, then compares the entry/exit counts per area. Exits with status 1 if any
+count differs from the every-frame baseline by more than --tolerance.
+
+Usage:
+    python validate_stride.py video.mp4 --area-id 1 --area-id 2 --stride 3
+    python validate_stride.py video.mp4 --polygon "100,400 600,400 600,700 100,700" --adaptive
+"""
+import argparse
+import sys
+import time
+from typing import Dict, Tuple
+
+import numpy as np
+
+import config
+from capture import FrameGrabber
+from inference import BatchScheduler, Detector
+from pipeline import StreamCounter, clean_polygon
+from stride import AdaptiveStride, FixedStride
+
+def count_video(path: str, polygons: Dict[int, np.ndarray], detector: Detector, stride_policy=None) -> Tuple[StreamCounter, int, int, float]:
+    """Counts a whole video file. Returns the counter, the number of frames, how many were detected and the wall time."""
+    scheduler = BatchScheduler(detector, batch_size=1, stride_policy=stride_policy)
+    scheduler.add_stream(0, FrameGrabber(path, live=False).start())
+    counter = StreamCounter(polygons)
+    frames = detected = 0
+    started = time.perf_counter()
+    try:
+        while True:
+            batch = scheduler.collect()
+            if not batch:
+                if scheduler.grabbers[0].ended:
+                    break
+                continue
+            for tracked in scheduler.process(batch):
+                counter.update(tracked.boxes, tracked.track_ids)
+                frames += 1
+                detected += tracked.detected
+    finally:
+        scheduler.remove_stream(0).stop()
+    return counter, frames, detected, time.perf_counter() - started
+
+def parse_polygon(value: str) -> np.ndarray:
+    polygon = clean_polygon([[int(n) for n in point.split(",")] for point in value.split()])
+    if polygon is None:
+        raise argparse.ArgumentTypeError("A polygon needs at least 3 'x,y' points.")
+    return polygon
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare frame-stride counts against running the detector on every frame.")
+    parser.add_argument("video", help="Path to a video file.")
+    parser.add_argument("--area-id", type=int, action="append", help="Area to count, loaded from the API. May be repeated.")
+    parser.add_argument("--polygon", type=parse_polygon, action="append", help="Polygon as 'x,y x,y x,y ...'. May be repeated.")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--stride", type=int, default=3, help="Fixed stride to validate (default: 3).")
+    mode.add_argument("--adaptive", action="store_true", help="Validate the adaptive stride instead of a fixed one.")
+    parser.add_argument("--tolerance", type=float, default=0.05, help="Max relative count error per area (default: 0.05).")
+    parser.add_argument("--model", default=config.MODEL_PATH)
+    args = parser.parse_args()
+
+    polygons = {}
+    if args.area_id:
+        from worker import fetch_area_polygons
+        polygons.update(fetch_area_polygons(args.area_id))
+    for i, polygon in enumerate(args.polygon or []):
+        polygons[-(i + 1)] = polygon
+    if not polygons:
+        parser.error("Give at least one --area-id or --polygon.")
+
+    detector = Detector(args.model)
+    baseline, frames, _, baseline_seconds = count_video(args.video, polygons, detector)
+    policy = AdaptiveStride if args.adaptive else (lambda: FixedStride(args.stride))
+    strided, _, detected, strided_seconds = count_video(args.video, polygons, detector, policy)
+
+    print(f"Frames: {frames}, detected with stride: {detected} ({detected / max(frames, 1):.0%})")
+    print(f"Wall time: every frame {baseline_seconds:.1f}s, with stride {strided_seconds:.1f}s "
+          f"({baseline_seconds / max(strided_seconds, 1e-9):.2f}x faster)")
+    print(f"{'area':>6} {'type':>6} {'every frame':>12} {'stride':>8} {'error':>7}")
+    failed = False
+    for area_id in polygons:
+        for event_type, expected, actual in (
+            ("entry", baseline.entry_counts[area_id], strided.entry_counts[area_id]),
+            ("exit", baseline.exit_counts[area_id], strided.exit_counts[area_id]),
+        ):
+            error = abs(actual - expected) / max(expected, 1)
+            failed |= error > args.tolerance
+            print(f"{area_id:>6} {event_type:>6} {expected:>12} {actual:>8} {error:>7.1%}")
+
+    if failed:
+        print(f"FAILED: counts differ by more than {args.tolerance:.0%}.")
+        sys.exit(1)
+    print("OK")
+
+if __name__ == "__main__":
+    main()
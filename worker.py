@@ -0,0 +1,433 @@
+"""
+Headless multi-camera counting worker.
+
+Runs the counting pipeline outside of Streamlit. Streams are split into groups of
+--streams-per-process (default 1) and each group runs in its own process, where the
+frames of all its streams are batched through one detector. Dropped live feeds and
+crashed processes are restarted with an increasing delay, and SIGINT/SIGTERM stops
+every stream cleanly after flushing its pending events.
+
+The supervisor serves Prometheus metrics of all stream processes (per-stage latency,
+frame latency, dropped frames, event delivery) at http://HOST:9101/metrics; see
+--metrics-port.
+
+With --preview-port PORT, stream process N serves an annotated MJPEG preview of its
+streams at http://HOST:(PORT + N)/streams/INDEX.mjpg, rendered only while watched.
+
+Usage:
+    python worker.py --stream rtsp://camera-1/stream 1,2 --stream videos/door.mp4 3
+    python worker.py --config streams.json --streams-per-process 4
+
+where streams.json looks like:
+    [{"source": "rtsp://camera-1/stream", "area_ids": [1, 2]}, ...]
+"""
+import argparse
+import json
+import logging
+import multiprocessing as mp
+import queue
+import signal
+import sys
+import time
+from typing import Dict, List, NamedTuple, Optional
+
+import numpy as np
+import requests
+
+import config
+import metrics
+from capture import FrameGrabber, is_live_source
+from event_buffer import EventBuffer
+from inference import STAGE_SECONDS, BatchScheduler, Detector
+from pipeline import StreamCounter, clean_polygon
+from preview import PreviewServer, PreviewStream
+from roi import RegionOfInterest
+
+logger = logging.getLogger("worker")
+
+FRAME_LATENCY = metrics.histogram(
+    "people_counter_frame_latency_seconds",
+    "Time from decoding a frame to counting it. A stream whose latency keeps growing is falling behind real time.",
+    ["stream"],
+)
+EVENTS = metrics.counter("people_counter_events_total", "Entry/exit events counted.", ["area_id", "event_type"])
+CAPTURE_QUEUE = metrics.gauge("people_counter_capture_queue_depth", "Decoded frames waiting for inference.", ["stream"])
+CAPTURE_DROPPED = metrics.counter(
+    "people_counter_capture_frames_dropped_total", "Live frames skipped because inference fell behind.", ["stream"],
+)
+SOURCE_FPS = metrics.gauge("people_counter_source_fps", "Frame rate reported by the video source.", ["stream"])
+RESTARTS = metrics.counter("people_counter_stream_restarts_total", "Restarts of crashed stream processes.", ["process"])
+
+class StreamAssignment(NamedTuple):
+    """A video source and the areas counted on it."""
+    source: str
+    area_ids: List[int]
+
+def configure_logging():
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(processName)s %(levelname)s %(message)s")
+
+def fetch_area_polygons(area_ids: List[int]) -> Dict[int, np.ndarray]:
+    """Fetches the configured areas from the API and returns the valid polygons for `area_ids`."""
+    res = requests.get(f"{config.API_URL}/api/areas/", timeout=10)
+    res.raise_for_status()
+
+    polygons = {}
+    for area in res.json():
+        if area['id'] not in area_ids:
+            continue
+        polygon = clean_polygon(area.get('coordinates'))
+        if polygon is None:
+            logger.warning("Area '%s' has invalid polygon data and will not be counted.", area['name'])
+            continue
+        polygons[area['id']] = polygon
+
+    missing = sorted(set(area_ids) - set(polygons))
+    if missing:
+        logger.warning("Areas %s are missing or invalid and will not be counted.", missing)
+    if not polygons:
+        raise RuntimeError(f"None of the areas {area_ids} could be loaded.")
+    return polygons
+
+def log_capture_stats(grabber: FrameGrabber):
+    stats = grabber.stats()
+    logger.info(
+        "Capture '%s': %d frames read, %d dropped, queue wait avg %.1fms / max %.1fms.",
+        grabber.source, stats.frames_read, stats.frames_dropped,
+        stats.avg_queue_wait * 1000, stats.max_queue_wait * 1000,
+    )
+
+def open_grabber(source: str) -> FrameGrabber:
+    grabber = FrameGrabber(source)
+    if not grabber.is_opened():
+        grabber.stop()
+        raise RuntimeError(f"Could not open video source '{source}'.")
+    return grabber.start()
+
+def run_streams(
+    assignments: List[StreamAssignment],
+    stop_event,
+    name: str = "worker",
+    preview_port: Optional[int] = None,
+    metrics_queue=None,
+):
+    """
+    Counts people on a group of streams until they all end or `stop_event` is set.
+    All streams of the group share one detector through a BatchScheduler.
+    Live feeds that drop are reconnected in place with exponential backoff.
+    Events go through a write-behind EventBuffer named `name`, so a slow database never stalls the loop.
+    With a `preview_port`, each stream's preview is served there under its index in `assignments`.
+    With a `metrics_queue`, a (name, snapshot) of this process's metrics is put on it every METRICS_PUSH_INTERVAL.
+    """
+    counters = {index: StreamCounter(fetch_area_polygons(a.area_ids)) for index, a in enumerate(assignments)}
+    labels = {index: metrics.source_label(a.source) for index, a in enumerate(assignments)}
+    dropped_seen: Dict[int, int] = {}
+    previews: Dict[int, PreviewStream] = {}
+    preview_server = None
+    if preview_port:
+        preview_server = PreviewServer(port=preview_port).start()
+        for index, counter in counters.items():
+            previews[index] = PreviewStream(counter.polygons)
+            preview_server.add_stream(index, previews[index])
+            logger.info("Preview of '%s' at http://<host>:%d/streams/%d.mjpg", assignments[index].source, preview_port, index)
+    scheduler = BatchScheduler(Detector())
+    failures = {index: 0 for index in counters}
+    connected_at: Dict[int, float] = {}
+    reconnect_at: Dict[int, float] = {}
+
+    def schedule_reconnect(index: int):
+        now = time.monotonic()
+        # A stream that stayed up for a while is considered healthy again
+        if now - connected_at.get(index, now) > config.WORKER_MAX_RESTART_DELAY:
+            failures[index] = 0
+        failures[index] += 1
+        delay = min(config.WORKER_RESTART_DELAY * 2 ** (failures[index] - 1), config.WORKER_MAX_RESTART_DELAY)
+        reconnect_at[index] = now + delay
+        logger.warning("Live feed '%s' dropped; reconnecting in %.1fs.", assignments[index].source, delay)
+
+    def connect(index: int):
+        source = assignments[index].source
+        try:
+            roi = RegionOfInterest(counters[index].polygons) if config.ROI_CROP else None
+            grabber = open_grabber(source)
+            scheduler.add_stream(index, grabber, roi)
+            connected_at[index] = time.monotonic()
+            dropped_seen[index] = 0
+            CAPTURE_QUEUE.labels(labels[index]).set_function(lambda: grabber.queued)
+            SOURCE_FPS.labels(labels[index]).set(grabber.fps)
+        except Exception:
+            if not is_live_source(source):
+                raise
+            logger.exception("Could not connect to '%s'.", source)
+            schedule_reconnect(index)
+
+    def count_dropped(index: int, grabber: FrameGrabber):
+        dropped = grabber.stats().frames_dropped
+        CAPTURE_DROPPED.labels(labels[index]).inc(dropped - dropped_seen.get(index, 0))
+        dropped_seen[index] = dropped
+
+    def push_metrics():
+        for index, grabber in scheduler.grabbers.items():
+            count_dropped(index, grabber)
+        if metrics_queue is not None:
+            try:
+                metrics_queue.put_nowait((name, metrics.REGISTRY.snapshot()))
+            except queue.Full:
+                pass  # The supervisor is behind; the next snapshot supersedes this one anyway
+
+    for index in counters:
+        connect(index)
+
+    events = EventBuffer(name)
+    next_stats_at = time.monotonic() + config.CAPTURE_STATS_INTERVAL
+    next_metrics_at = time.monotonic() + config.METRICS_PUSH_INTERVAL
+    try:
+        while not stop_event.is_set():
+            now = time.monotonic()
+            for index, at in list(reconnect_at.items()):
+                if now >= at:
+                    del reconnect_at[index]
+                    connect(index)
+            if not scheduler.grabbers:
+                if not reconnect_at:
+                    break
+                stop_event.wait(0.5)
+                continue
+
+            batch = scheduler.collect(timeout=1.0)
+            if batch:
+                for tracked in scheduler.process(batch):
+                    counter = counters[tracked.stream]
+                    label = labels[tracked.stream]
+                    zones_started = time.perf_counter()
+                    new_events = counter.update(tracked.boxes, tracked.track_ids)
+                    STAGE_SECONDS.labels(label, "zones").observe(time.perf_counter() - zones_started)
+                    for event in new_events:
+                        events.add(event.area_id, event.event_type, event.tracker_id)
+                        EVENTS.labels(event.area_id, event.event_type).inc()
+                    FRAME_LATENCY.labels(label).observe(time.monotonic() - tracked.captured.captured_at)
+                    preview = previews.get(tracked.stream)
+                    if preview is not None and preview.watched:
+                        preview.publish(tracked.captured.frame, tracked.boxes, tracked.track_ids, counter.entry_counts, counter.exit_counts)
+
+            for index, grabber in list(scheduler.grabbers.items()):
+                if not grabber.ended:
+                    continue
+                scheduler.remove_stream(index)
+                grabber.stop()
+                log_capture_stats(grabber)
+                count_dropped(index, grabber)
+                CAPTURE_QUEUE.labels(labels[index]).set_function(lambda: 0)
+                if grabber.live:
+                    schedule_reconnect(index)
+                else:
+                    logger.info("Stream '%s' finished.", grabber.source)
+
+            if time.monotonic() >= next_stats_at:
+                for grabber in scheduler.grabbers.values():
+                    log_capture_stats(grabber)
+                next_stats_at = time.monotonic() + config.CAPTURE_STATS_INTERVAL
+
+            if time.monotonic() >= next_metrics_at:
+                push_metrics()
+                next_metrics_at = time.monotonic() + config.METRICS_PUSH_INTERVAL
+    finally:
+        for index in list(scheduler.grabbers):
+            grabber = scheduler.remove_stream(index)
+            grabber.stop()
+            log_capture_stats(grabber)
+            count_dropped(index, grabber)
+        events.close(timeout=config.WORKER_SHUTDOWN_TIMEOUT / 2)
+        push_metrics()
+        if preview_server is not None:
+            preview_server.stop()
+
+def _stream_process(assignments: List[StreamAssignment], stop_event, preview_port: Optional[int] = None, metrics_queue=None):
+    """Entry point of a stream process. Exits with 0 once all its streams finished and 1 if it crashed."""
+    # Shutdown is coordinated by the supervisor through stop_event.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if metrics_queue is not None:
+        # Don't hang on exit over a snapshot the supervisor will never read
+        metrics_queue.cancel_join_thread()
+    configure_logging()
+    for assignment in assignments:
+        logger.info("Starting stream '%s' for areas %s.", assignment.source, assignment.area_ids)
+    try:
+        run_streams(assignments, stop_event, mp.current_process().name, preview_port, metrics_queue)
+    except Exception:
+        logger.exception("Streams %s crashed.", [a.source for a in assignments])
+        sys.exit(1)
+
+class StreamSupervisor:
+    """
+    Runs each group of stream assignments in its own process.
+    Processes that exit with an error are restarted with exponential backoff;
+    processes whose streams all finished normally (e.g. the end of a video file) are not.
+    """
+    def __init__(
+        self,
+        groups: List[List[StreamAssignment]],
+        restart_delay: float = config.WORKER_RESTART_DELAY,
+        max_restart_delay: float = config.WORKER_MAX_RESTART_DELAY,
+        shutdown_timeout: float = config.WORKER_SHUTDOWN_TIMEOUT,
+        preview_port: int = config.WORKER_PREVIEW_PORT,
+        metrics_port: int = config.WORKER_METRICS_PORT,
+    ):
+        self.groups = groups
+        self.preview_port = preview_port
+        self.metrics_port = metrics_port
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.shutdown_timeout = shutdown_timeout
+        # spawn avoids forking a process that may already hold OpenCV/torch threads
+        self._ctx = mp.get_context("spawn")
+        self._stop_event = self._ctx.Event()
+        self._stopping = False
+        self._processes: Dict[int, mp.Process] = {}
+        self._started_at: Dict[int, float] = {}
+        self._failures = [0] * len(groups)
+        self._restart_at: Dict[int, float] = {}
+        self._metrics_queue = self._ctx.Queue(maxsize=100) if metrics_port else None
+        self._snapshots: Dict[str, dict] = {}  # Latest metrics snapshot of each stream process
+
+    def _start(self, index: int):
+        process = self._ctx.Process(
+            target=_stream_process,
+            args=(
+                self.groups[index],
+                self._stop_event,
+                self.preview_port + index if self.preview_port else None,
+                self._metrics_queue,
+            ),
+            name=f"streams-{index}",
+        )
+        process.start()
+        self._processes[index] = process
+        self._started_at[index] = time.monotonic()
+
+    def _reap(self, now: float):
+        """Collects exited processes and schedules restarts for the ones that failed."""
+        for index, process in list(self._processes.items()):
+            if process.is_alive():
+                continue
+            del self._processes[index]
+            if process.exitcode == 0:
+                continue
+
+            # A stream that stayed up for a while is considered healthy again
+            if now - self._started_at[index] > self.max_restart_delay:
+                self._failures[index] = 0
+            self._failures[index] += 1
+            delay = min(self.restart_delay * 2 ** (self._failures[index] - 1), self.max_restart_delay)
+            self._restart_at[index] = now + delay
+            RESTARTS.labels(process.name).inc()
+            logger.warning(
+                "Process %s exited with code %s; restarting in %.1fs.",
+                process.name, process.exitcode, delay,
+            )
+
+    def _collect_metrics(self):
+        """Keeps the latest metrics snapshot sent by each stream process."""
+        while self._metrics_queue is not None:
+            try:
+                name, snapshot = self._metrics_queue.get_nowait()
+            except queue.Empty:
+                return
+            self._snapshots[name] = snapshot
+
+    def render_metrics(self) -> str:
+        return metrics.render_snapshots([metrics.REGISTRY.snapshot(), *list(self._snapshots.values())])
+
+    def run(self, poll_interval: float = 0.5):
+        """Starts every stream and supervises them until all finish or `stop()` is called."""
+        metrics_server = None
+        if self.metrics_port:
+            metrics_server = metrics.MetricsServer(self.metrics_port, self.render_metrics).start()
+            logger.info("Serving metrics at http://<host>:%d/metrics", self.metrics_port)
+        for index in range(len(self.groups)):
+            self._start(index)
+
+        while not self._stopping:
+            now = time.monotonic()
+            self._collect_metrics()
+            self._reap(now)
+            for index, restart_at in list(self._restart_at.items()):
+                if now >= restart_at:
+                    del self._restart_at[index]
+                    self._start(index)
+            if not self._processes and not self._restart_at:
+                logger.info("All streams finished.")
+                break
+            time.sleep(poll_interval)
+
+        self.shutdown()
+        if metrics_server is not None:
+            metrics_server.stop()
+
+    def stop(self):
+        """Requests a shutdown. Safe to call from a signal handler."""
+        self._stopping = True
+
+    def shutdown(self):
+        """Signals every stream to stop, waits for them to flush, then terminates stragglers."""
+        self._stop_event.set()
+        deadline = time.monotonic() + self.shutdown_timeout
+        for process in self._processes.values():
+            process.join(max(0.0, deadline - time.monotonic()))
+        self._collect_metrics()
+        for process in self._processes.values():
+            if process.is_alive():
+                logger.warning("Stream process %s did not stop in time; terminating.", process.name)
+                process.terminate()
+                process.join()
+        self._processes.clear()
+        self._restart_at.clear()
+
+def parse_area_ids(value: str) -> List[int]:
+    return [int(area_id) for area_id in value.split(",") if area_id.strip()]
+
+def load_assignments(args: argparse.Namespace) -> List[StreamAssignment]:
+    """Builds the stream assignments from --config and/or --stream arguments."""
+    assignments = []
+    if args.config:
+        with open(args.config) as f:
+            for entry in json.load(f):
+                assignments.append(StreamAssignment(str(entry['source']), [int(i) for i in entry['area_ids']]))
+    for source, area_ids in args.stream or []:
+        assignments.append(StreamAssignment(source, parse_area_ids(area_ids)))
+    return assignments
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless multi-camera people counting worker.")
+    parser.add_argument("--config", help="JSON file with a list of {\"source\": ..., \"area_ids\": [...]} assignments.")
+    parser.add_argument(
+        "--stream", nargs=2, action="append", metavar=("SOURCE", "AREA_IDS"),
+        help="A video source and a comma-separated list of area ids. May be repeated.",
+    )
+    parser.add_argument(
+        "--streams-per-process", type=int, default=config.WORKER_STREAMS_PER_PROCESS,
+        help="Number of streams batched through one detector in each process.",
+    )
+    parser.add_argument(
+        "--preview-port", type=int, default=config.WORKER_PREVIEW_PORT,
+        help="Serve MJPEG previews from this port on (one port per stream process). 0 disables them.",
+    )
+    parser.add_argument(
+        "--metrics-port", type=int, default=config.WORKER_METRICS_PORT,
+        help="Port of the Prometheus /metrics endpoint. 0 disables it.",
+    )
+    args = parser.parse_args()
+
+    configure_logging()
+    assignments = load_assignments(args)
+    if not assignments:
+        parser.error("No streams configured. Use --config or --stream.")
+
+    group_size = max(1, args.streams_per_process)
+    groups = [assignments[i:i + group_size] for i in range(0, len(assignments), group_size)]
+    supervisor = StreamSupervisor(groups, preview_port=args.preview_port, metrics_port=args.metrics_port)
+    signal.signal(signal.SIGINT, lambda *_: supervisor.stop())
+    signal.signal(signal.SIGTERM, lambda *_: supervisor.stop())
+    supervisor.run()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+import collections
+from typing import Dict, List, NamedTuple, Tuple
+
+import cv2
+import numpy as np
+
+import config
+
+class ZoneEvent(NamedTuple):
+    """A single entry or exit of a tracked person for one area."""
+    area_id: int
+    event_type: str  # 'entry' or 'exit'
+    tracker_id: int
+
+class TrackState:
+    """Zone state of one track: whether it is inside each area, and for how many frames it has looked otherwise."""
+    __slots__ = ("inside", "streak", "last_seen")
+
+    def __init__(self, num_areas: int, frame: int):
+        self.inside = np.zeros(num_areas, dtype=bool)
+        self.streak = np.zeros(num_areas, dtype=np.uint16)
+        self.last_seen = frame
+
+class TrackStateStore:
+    """
+    The zone state of every track of one stream, bounded in size.
+
+    Tracks not seen for `ttl` frames are evicted, and when more than `max_tracks` are alive the
+    least recently seen go first, so memory stays flat however long a stream runs and however
+    high the tracker's ids climb. A track that reappears after eviction starts over as outside.
+    """
+    def __init__(self, num_areas: int, ttl: int = config.ZONE_TRACK_TTL_FRAMES, max_tracks: int = config.ZONE_MAX_TRACKS):
+        self.num_areas = num_areas
+        self.ttl = max(1, ttl)
+        self.max_tracks = max(1, max_tracks)
+        self.frame = 0
+        self.evicted = 0
+        self._tracks: "collections.OrderedDict[int, TrackState]" = collections.OrderedDict()  # Least recently seen first
+
+    def __len__(self) -> int:
+        return len(self._tracks)
+
+    def __contains__(self, track_id: int) -> bool:
+        return track_id in self._tracks
+
+    def advance(self):
+        """Starts a new frame and evicts the tracks that weren't seen for `ttl` frames."""
+        self.frame += 1
+        expired_before = self.frame - self.ttl
+        while self._tracks:
+            state = next(iter(self._tracks.values()))
+            if state.last_seen >= expired_before:
+                break
+            self._tracks.popitem(last=False)
+            self.evicted += 1
+
+    def seen(self, track_id: int) -> TrackState:
+        """Returns the state of a track seen in the current frame, creating it if needed."""
+        state = self._tracks.get(track_id)
+        if state is None:
+            state = self._tracks[track_id] = TrackState(self.num_areas, self.frame)
+            while len(self._tracks) > self.max_tracks:
+                self._tracks.popitem(last=False)
+                self.evicted += 1
+        else:
+            self._tracks.move_to_end(track_id)
+            state.last_seen = self.frame
+        return state
+
+class ZoneEngine:
+    """
+    Tests the anchor points of all tracks against all areas of one camera in a single pass
+    and keeps the inside/outside state of every (track, area) pair in a bounded TrackStateStore.
+
+    The polygons are rasterized once into a bit mask covering their union bounding box,
+    one bit per area. Points outside that box are rejected immediately and the rest cost
+    a single array lookup. If the areas are too many or too large for a mask, it falls back
+    to a vectorized ray-casting test behind a per-area bounding-box check.
+
+    Transitions are debounced so a person standing on an edge doesn't flood the database:
+    a track outside an area only counts as inside once its anchor is at least `margin` pixels
+    inside the polygon, and an inside track only leaves once it is more than `margin` pixels
+    outside (hysteresis). The new side must then hold for `min_dwell` consecutive frames before
+    the entry or exit is reported.
+    """
+    MAX_RASTER_PIXELS = 16_000_000
+
+    def __init__(
+        self,
+        polygons: Dict[int, np.ndarray],
+        margin: int = config.ZONE_HYSTERESIS_PX,
+        min_dwell: int = config.ZONE_MIN_DWELL_FRAMES,
+        ttl: int = config.ZONE_TRACK_TTL_FRAMES,
+        max_tracks: int = config.ZONE_MAX_TRACKS,
+    ):
+        self.area_ids = list(polygons)
+        self.margin = max(0, int(margin))
+        self.min_dwell = max(1, min_dwell)
+        self.tracks = TrackStateStore(len(self.area_ids), ttl, max_tracks)
+        self._mask = None
+        if not polygons:
+            return
+
+        polys = [np.asarray(p, dtype=np.int64).reshape(-1, 2) for p in polygons.values()]
+        all_points = np.concatenate(polys)
+        # Leave room for the outer hysteresis band around the polygons
+        self._origin = np.maximum(all_points.min(axis=0) - self.margin, 0)
+        self._size = all_points.max(axis=0) + 1 + self.margin - self._origin  # (width, height)
+
+        mask_dtype = next((dt for dt in (np.uint8, np.uint16, np.uint32, np.uint64) if np.dtype(dt).itemsize * 8 >= len(polys)), None)
+        if mask_dtype is not None and (self._size > 0).all() and self._size.prod() * (3 if self.margin else 1) <= self.MAX_RASTER_PIXELS:
+            self._build_mask(polys, mask_dtype)
+        else:
+            self._build_edges(polys)
+
+    def _build_mask(self, polys: List[np.ndarray], dtype):
+        width, height = self._size
+        self._mask = np.zeros((height, width), dtype=dtype)
+        if self.margin:
+            # Points at least `margin` inside, and points at most `margin` outside, of each polygon
+            self._inner = np.zeros_like(self._mask)
+            self._outer = np.zeros_like(self._mask)
+            kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * self.margin + 1, 2 * self.margin + 1))
+        layer = np.empty((height, width), dtype=np.uint8)
+        for bit, poly in enumerate(polys):
+            layer.fill(0)
+            cv2.fillPoly(layer, [(poly - self._origin).astype(np.int32)], 1)
+            self._mask |= layer.astype(dtype) << dtype(bit)
+            if self.margin:
+                self._inner |= cv2.erode(layer, kernel, borderValue=0).astype(dtype) << dtype(bit)
+                self._outer |= cv2.dilate(layer, kernel).astype(dtype) << dtype(bit)
+        self._bits = (np.ones(len(polys), dtype=dtype) << np.arange(len(polys), dtype=dtype))
+
+    def _build_edges(self, polys: List[np.ndarray]):
+        starts, start = [], 0
+        for poly in polys:
+            starts.append(start)
+            start += len(poly)
+        self._edge_starts = np.array(starts)
+        p1 = np.concatenate(polys).astype(np.float64)
+        p2 = np.concatenate([np.roll(poly, -1, axis=0) for poly in polys]).astype(np.float64)
+        self._x1, self._y1 = p1[:, 0], p1[:, 1]
+        self._x2, self._y2 = p2[:, 0], p2[:, 1]
+        dy = self._y2 - self._y1
+        # Horizontal edges never cross the ray; the guard only avoids dividing by zero
+        self._slope = (p2[:, 0] - self._x1) / np.where(dy == 0, 1, dy)
+        self._bbox_min = np.array([poly.min(axis=0) for poly in polys])
+        self._bbox_max = np.array([poly.max(axis=0) for poly in polys])
+
+    def contains(self, points: np.ndarray) -> np.ndarray:
+        """Returns a (num_points, num_areas) bool matrix telling which area each point is in."""
+        points = np.asarray(points, dtype=np.int64).reshape(-1, 2)
+        if not self.area_ids or len(points) == 0:
+            return np.zeros((len(points), len(self.area_ids)), dtype=bool)
+        if self._mask is not None:
+            return self._lookup(points, self._mask)
+        return self._contains_ray_cast(points)
+
+    def classify(self, points: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns two (num_points, num_areas) bool matrices: points at least `margin` inside each area,
+        and points inside or at most `margin` outside of it. Both equal `contains` without a margin.
+        """
+        points = np.asarray(points, dtype=np.int64).reshape(-1, 2)
+        if not self.margin or not self.area_ids or len(points) == 0:
+            inside = self.contains(points)
+            return inside, inside
+        if self._mask is not None:
+            return self._lookup(points, self._inner), self._lookup(points, self._outer)
+        inside = self._contains_ray_cast(points)
+        distance = self._boundary_distance(points)
+        return inside & (distance >= self.margin), inside | (distance <= self.margin)
+
+    def _lookup(self, points: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        local = points - self._origin
+        in_box = (local >= 0).all(axis=1) & (local < self._size).all(axis=1)
+        values = np.zeros(len(points), dtype=mask.dtype)
+        values[in_box] = mask[local[in_box, 1], local[in_box, 0]]
+        return (values[:, None] & self._bits) != 0
+
+    def _boundary_distance(self, points: np.ndarray) -> np.ndarray:
+        """Returns the (num_points, num_areas) distance from each point to the nearest edge of each area."""
+        x = points[:, 0:1].astype(np.float64)
+        y = points[:, 1:2].astype(np.float64)
+        dx, dy = self._x2 - self._x1, self._y2 - self._y1
+        length = np.where(dx * dx + dy * dy == 0, 1, dx * dx + dy * dy)
+        t = np.clip(((x - self._x1) * dx + (y - self._y1) * dy) / length, 0, 1)
+        distance = np.hypot(x - (self._x1 + t * dx), y - (self._y1 + t * dy))
+        return np.minimum.reduceat(distance, self._edge_starts, axis=1)
+
+    def _contains_ray_cast(self, points: np.ndarray) -> np.ndarray:
+        inside = np.zeros((len(points), len(self.area_ids)), dtype=bool)
+        in_bbox = ((points[:, None, :] >= self._bbox_min) & (points[:, None, :] <= self._bbox_max)).all(axis=2)
+        candidates = in_bbox.any(axis=1)
+        if not candidates.any():
+            return inside
+
+        x = points[candidates, 0:1].astype(np.float64)
+        y = points[candidates, 1:2].astype(np.float64)
+        crosses = ((self._y1 > y) != (self._y2 > y)) & (x < self._slope * (y - self._y1) + self._x1)
+        crossings = np.add.reduceat(crosses.astype(np.int32), self._edge_starts, axis=1)
+        inside[candidates] = (crossings % 2 == 1) & in_bbox[candidates]
+        return inside
+
+    def update(self, track_ids: np.ndarray, points: np.ndarray) -> List[ZoneEvent]:
+        """Evaluates one frame's anchor points and returns the entry/exit transitions it confirmed."""
+        self.tracks.advance()
+        if len(track_ids) == 0:
+            return []
+        deep_inside, near_or_inside = self.classify(points)
+        states = [self.tracks.seen(int(track_id)) for track_id in track_ids]
+        was_inside = np.array([state.inside for state in states])
+        streak = np.array([state.streak for state in states])
+
+        # Inside tracks stay inside until clearly out; outside tracks need to be clearly in
+        looks_inside = np.where(was_inside, near_or_inside, deep_inside)
+        changing = looks_inside != was_inside
+        streak = np.where(changing, streak + 1, 0).astype(np.uint16)
+        confirmed = changing & (streak >= self.min_dwell)
+        is_inside = was_inside ^ confirmed
+        streak[confirmed] = 0
+
+        for state, inside_row, streak_row in zip(states, is_inside, streak):
+            state.inside[:] = inside_row
+            state.streak[:] = streak_row
+
+        events = []
+        for i, j in np.argwhere(confirmed):
+            event_type = 'entry' if is_inside[i, j] else 'exit'
+            events.append(ZoneEvent(self.area_ids[j], event_type, int(track_ids[i])))
+        return events